@@ -1,8 +1,13 @@
 import os
 import json
+import urllib.error
+
 import click
 
-from .apng import APNGProcessorHeadless
+from .batch import run_batch
+from .constants import SERVER_HOST, SERVER_PORT
+from .journal import Journal, get_journal_path
+from .resources import ResourceBudget, parse_size
 from .version import __version__
 
 
@@ -15,24 +20,87 @@ def cli(ctx):
         from .ui import start
         start()
     else:
-        click.echo(f"Running apngc {__version__} {ctx.invoked_subcommand}...")
+        # To stderr, so output like `inspect --json` can be piped
+        click.echo(
+            f"Running apngc {__version__} {ctx.invoked_subcommand}...",
+            err=True,
+        )
 
 
 @cli.command()
 @click.option("--settings",
               help="Specify settings preset JSON filename or full path")
-@click.option("--folder",
-              help="Specify the folder containing the source "
-                   "sequence to convert")
+@click.option("--folder", multiple=True,
+              help="Specify the folder containing the source sequence, "
+                   "or a video file, to convert. Can be given multiple "
+                   "times")
 @click.option("--output_path", help="The output directory", default=None)
 @click.option("--tinify",
               help="Override tinify API key (instead of using"
                    " from settings file)",
               default=None)
-def headless(settings, folder, output_path, tinify):
+@click.option("--manifest",
+              help="JSONL manifest of jobs to process instead of a single "
+                   "folder. Multiple workers on different machines can "
+                   "process the same manifest on a shared filesystem.",
+              default=None)
+@click.option("--worker_id",
+              help="Name of this worker when processing a manifest "
+                   "(defaults to hostname and process id)",
+              default=None)
+@click.option("--frame_start", type=int, default=None,
+              help="First frame of the sequence or video to convert")
+@click.option("--frame_end", type=int, default=None,
+              help="Last frame of the sequence or video to convert")
+@click.option("--source_framerate", type=float, default=None,
+              help="Frame rate of the source, frames are dropped or "
+                   "repeated to the frame rate of the settings (probed "
+                   "from videos by default)")
+@click.option("--journal",
+              help="Journal file recording the state of each folder "
+                   "(defaults to a journal in the output directory)",
+              default=None)
+@click.option("--resume", is_flag=True,
+              help="Skip folders that the journal records as completed "
+                   "with the same inputs and settings")
+@click.option("--threads", type=int, default=None,
+              help="Maximum number of CPU threads used by all folders "
+                   "together (defaults to the number of cores)")
+@click.option("--memory", default=None,
+              help="Maximum memory used by all folders together, "
+                   "e.g. 16G (defaults to most of the physical memory)")
+@click.option("--dedup/--no-dedup", default=True,
+              help="Convert folders with identical frames only once and "
+                   "resize identical frames only once (default on)")
+@click.option("--preflight/--no-preflight", default=True,
+              help="Check all folders for corrupt or missing frames before "
+                   "converting any, and skip the bad ones (default on)")
+@click.option("--frame_cache/--no-frame_cache", default=True,
+              help="Reuse frames resized or recompressed by earlier runs, "
+                   "so rebuilds only process changed frames (default on)")
+@click.option("--cache_size", default=None,
+              help="Maximum size of the frame cache, e.g. 4G (default 2G)")
+@click.option("--estimate", is_flag=True,
+              help="Only estimate output sizes and processing time by "
+                   "converting a few sample frames of each folder")
+def headless(settings, folder, output_path, tinify, manifest, worker_id,
+             frame_start, frame_end, source_framerate, journal, resume,
+             threads, memory, dedup, preflight, frame_cache, cache_size,
+             estimate):
     click.echo('Processing headless')
 
-    folder = os.path.abspath(folder)
+    if manifest:
+        from .manifest import ManifestWorker
+
+        worker = ManifestWorker(manifest, worker_id=worker_id, tinify=tinify)
+        failed = worker.run()
+        if failed:
+            raise click.ClickException(f"{failed} job(s) failed")
+        return
+
+    if not settings or not folder:
+        raise click.UsageError("Specify --settings and --folder, "
+                               "or --manifest")
 
     with open(settings, "r") as f:
         settings = json.load(f)
@@ -45,11 +113,183 @@ def headless(settings, folder, output_path, tinify):
     if output_path:
         settings["output_path"] = output_path
 
+    # Override frame range
+    if frame_start is not None:
+        settings["frame_start"] = frame_start
+    if frame_end is not None:
+        settings["frame_end"] = frame_end
+    if source_framerate:
+        settings["source_framerate"] = source_framerate
+
     print("Found settings:")
     print(json.dumps(settings, indent=4))
 
-    processor = APNGProcessorHeadless(folder, settings)
-    processor.process()
+    if estimate:
+        from .estimate import estimate_batch, format_estimate
+
+        budget = ResourceBudget(threads=threads, memory=parse_size(memory))
+        result = estimate_batch(
+            [os.path.abspath(seq_dir) for seq_dir in folder], settings,
+            budget=budget, dedup=dedup,
+        )
+        click.echo(format_estimate(result))
+        return
+
+    os.makedirs(settings["output_path"], exist_ok=True)
+    journal = Journal(journal or get_journal_path(settings["output_path"]))
+
+    seq_dirs = []
+    entries = journal.entries() if resume else None
+    for seq_dir in folder:
+        seq_dir = os.path.abspath(seq_dir)
+        if resume and journal.is_complete(seq_dir, settings, entries=entries):
+            click.echo(f"Skipping completed {seq_dir}")
+            continue
+        seq_dirs.append(seq_dir)
+
+    budget = ResourceBudget(threads=threads, memory=parse_size(memory))
+    if frame_cache:
+        from .cache import CACHE_SIZE, FrameCache
+
+        frame_cache = FrameCache(
+            max_size=parse_size(cache_size) or CACHE_SIZE
+        )
+    else:
+        frame_cache = None
+    failed_dirs = run_batch(
+        seq_dirs, settings, journal=journal, budget=budget, dedup=dedup,
+        check=preflight, frame_cache=frame_cache,
+    )
+    for seq_dir in failed_dirs:
+        click.echo(f"Failed {seq_dir}", err=True)
+
+    if failed_dirs:
+        raise click.ClickException(f"{len(failed_dirs)} folder(s) failed")
+
+
+@cli.command()
+@click.option("--host", help="Address to listen on", default=SERVER_HOST)
+@click.option("--port", help="Port to listen on", default=SERVER_PORT,
+              type=int)
+@click.option("--workers",
+              help="Maximum number of jobs to process at the same time "
+                   "(defaults to the number of cores)",
+              default=None, type=int)
+@click.option("--threads", type=int, default=None,
+              help="Maximum number of CPU threads used by all jobs "
+                   "together (defaults to the number of cores)")
+@click.option("--memory", default=None,
+              help="Maximum memory used by all jobs together, e.g. 16G "
+                   "(defaults to most of the physical memory)")
+def serve(host, port, workers, threads, memory):
+    """Keep running and process jobs submitted with `apngc submit`"""
+    from .server import serve as run_server
+
+    budget = ResourceBudget(threads=threads, memory=parse_size(memory))
+    run_server(host=host, port=port, workers=workers, budget=budget)
+
+
+@cli.command()
+@click.option("--settings",
+              help="Specify settings preset name, JSON filename or "
+                   "full path")
+@click.option("--folder", multiple=True,
+              help="Specify the folder containing the source sequence "
+                   "to convert, can be given multiple times")
+@click.option("--output_path", help="The output directory", default=None)
+@click.option("--tinify",
+              help="Override tinify API key (instead of using"
+                   " from settings file)",
+              default=None)
+@click.option("--priority", help="Higher priority jobs are processed first",
+              default=0, type=int)
+@click.option("--wait/--no-wait", help="Wait for the jobs to finish",
+              default=True)
+@click.option("--host", help="Address of the server", default=SERVER_HOST)
+@click.option("--port", help="Port of the server", default=SERVER_PORT,
+              type=int)
+def submit(settings, folder, output_path, tinify, priority, wait, host, port):
+    """Submit jobs to a running `apngc serve`"""
+    from .server import DONE, iter_job_events, submit_job
+
+    jobs = []
+    failed = 0
+    try:
+        for seq_dir in folder:
+            job = submit_job(seq_dir, settings, output_path=output_path,
+                             tinify=tinify, priority=priority,
+                             host=host, port=port)
+            click.echo(f"Submitted {job['id']}: {job['folder']}")
+            jobs.append(job)
+
+        if not wait:
+            return
+
+        for job in jobs:
+            for state in iter_job_events(job["id"], host=host, port=port):
+                click.echo(f"{state['id']} {state['status']} "
+                           f"{state['progress']}%")
+            if state["status"] != DONE:
+                click.echo(f"{state['id']} failed: {state['error']}",
+                           err=True)
+                failed += 1
+    except urllib.error.URLError as e:
+        raise click.ClickException(
+            f"Could not reach the server at {host}:{port}: {e.reason}"
+        )
+    except (RuntimeError, ConnectionError) as e:
+        raise click.ClickException(str(e))
+
+    if failed:
+        raise click.ClickException(f"{failed} job(s) failed")
+
+
+@cli.command()
+@click.argument("paths", nargs=-1, required=True)
+@click.option("--json", "as_json", is_flag=True,
+              help="Output the full per-frame report as JSON")
+@click.option("--top", default=5, type=int,
+              help="Number of largest frames to list per file")
+def inspect(paths, as_json, top):
+    """Report per-frame sizes of APNG files or directories of them"""
+    from .analyze import analyze_paths, format_report
+
+    reports = analyze_paths(paths)
+    if as_json:
+        click.echo(json.dumps(reports, indent=4))
+    else:
+        for report in reports:
+            click.echo(format_report(report, top=top))
+
+
+@cli.command()
+@click.argument("folders", nargs=-1, required=True)
+@click.option("--settings", default=None,
+              help="Settings preset JSON filename or full path, for the "
+                   "frame range")
+@click.option("--json", "as_json", is_flag=True,
+              help="Output the report as JSON")
+def check(folders, settings, as_json):
+    """Check sequences for corrupt, mixed or missing frames"""
+    from .preflight import format_preflight, preflight
+
+    settings_data = {}
+    if settings:
+        with open(settings, "r") as f:
+            settings_data = json.load(f)
+
+    reports = preflight(
+        [os.path.abspath(folder) for folder in folders], settings_data
+    )
+    if as_json:
+        click.echo(json.dumps(reports, indent=4))
+    else:
+        for report in reports:
+            click.echo(format_preflight(report))
+
+    rejected = len([report for report in reports if not report["ok"]])
+    if rejected:
+        raise click.ClickException(f"{rejected} folder(s) rejected")
 
 
 def main():
@@ -0,0 +1,160 @@
+import logging
+import os
+
+from .png import (
+    PNGError,
+    iter_chunk_headers,
+    parse_actl,
+    parse_fctl,
+    parse_ihdr,
+)
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+DISPOSE_OPS = {0: "none", 1: "background", 2: "previous"}
+BLEND_OPS = {0: "source", 1: "over"}
+
+
+def analyze_apng(path):
+    """Returns the frame by frame breakdown of an (A)PNG.
+
+    Only chunk headers and control chunks are read, image data is
+    skipped, so this is fast even on very large files.
+
+    Args:
+        path (str): the path to the (A)PNG.
+    Returns:
+        report (dict): file level totals and a `frames` list with the
+            compressed bytes, region, dispose/blend ops and delay of each
+            frame.
+    Raises:
+        PNGError: if the file is not a valid PNG.
+    """
+    report = {
+        "path": os.path.abspath(path),
+        "bytes": os.path.getsize(path),
+        "width": None,
+        "height": None,
+        "animated": False,
+        "plays": None,
+        "frame_count": 0,
+        "duration": 0.0,
+        "image_bytes": 0,
+        "metadata_bytes": 0,
+        "frames": [],
+    }
+
+    frames = report["frames"]
+    default_bytes = 0
+    with open(path, "rb") as f:
+        for chunk_type, length, data in iter_chunk_headers(f):
+            if chunk_type == b"IHDR":
+                ihdr = parse_ihdr(data)
+                report["width"] = ihdr["width"]
+                report["height"] = ihdr["height"]
+            elif chunk_type == b"acTL":
+                report["animated"] = True
+                report["plays"] = parse_actl(data)["plays"]
+            elif chunk_type == b"fcTL":
+                fctl = parse_fctl(data)
+                frames.append({
+                    "index": len(frames),
+                    "bytes": 0,
+                    "width": fctl["width"],
+                    "height": fctl["height"],
+                    "x_offset": fctl["x_offset"],
+                    "y_offset": fctl["y_offset"],
+                    "dispose_op": DISPOSE_OPS.get(fctl["dispose_op"]),
+                    "blend_op": BLEND_OPS.get(fctl["blend_op"]),
+                    "delay": fctl["delay_num"] / fctl["delay_den"],
+                })
+            elif chunk_type == b"IDAT":
+                if frames:
+                    frames[-1]["bytes"] += length
+                else:
+                    # Still image, or the default image of an APNG that
+                    # isn't part of the animation
+                    default_bytes += length
+                report["image_bytes"] += length
+            elif chunk_type == b"fdAT":
+                if frames:
+                    # First 4 bytes are the sequence number
+                    frames[-1]["bytes"] += length - 4
+                report["image_bytes"] += length - 4
+
+    if not report["animated"]:
+        frames.append({
+            "index": 0,
+            "bytes": default_bytes,
+            "width": report["width"],
+            "height": report["height"],
+            "x_offset": 0,
+            "y_offset": 0,
+            "dispose_op": None,
+            "blend_op": None,
+            "delay": 0.0,
+        })
+    elif default_bytes:
+        report["default_image_bytes"] = default_bytes
+
+    report["frame_count"] = len(frames)
+    report["duration"] = round(sum(frame["delay"] for frame in frames), 6)
+    report["metadata_bytes"] = report["bytes"] - report["image_bytes"]
+    return report
+
+
+def find_pngs(paths):
+    """Returns all PNG files in the given files and directories"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _dirs, files in os.walk(path):
+                found.extend(
+                    os.path.join(root, filename)
+                    for filename in sorted(files)
+                    if filename.lower().endswith(".png")
+                    and not filename.startswith(".")
+                )
+        else:
+            found.append(path)
+    return found
+
+
+def analyze_paths(paths):
+    """Returns the reports of all PNGs in the given files and
+    directories, with an `error` report for unreadable files."""
+    reports = []
+    for path in find_pngs(paths):
+        try:
+            reports.append(analyze_apng(path))
+        except (OSError, PNGError) as e:
+            LOGGER.error(f"Failed to analyze {path}: {e}")
+            reports.append({"path": os.path.abspath(path), "error": str(e)})
+    return reports
+
+
+def format_report(report, top=5):
+    """Returns a short human readable summary of a report"""
+    if "error" in report:
+        return f"{report['path']}: {report['error']}"
+
+    lines = [
+        f"{report['path']}",
+        f"  {report['width']}x{report['height']}, "
+        f"{report['frame_count']} frames, {report['duration']:.2f}s, "
+        f"{report['bytes']} bytes "
+        f"({report['metadata_bytes']} outside image data)",
+    ]
+    largest = sorted(
+        report["frames"], key=lambda frame: frame["bytes"], reverse=True
+    )
+    for frame in largest[:top]:
+        share = frame["bytes"] / max(report["image_bytes"], 1) * 100
+        lines.append(
+            f"  frame {frame['index']}: {frame['bytes']} bytes ({share:.1f}%),"
+            f" {frame['width']}x{frame['height']}"
+            f"+{frame['x_offset']}+{frame['y_offset']}, "
+            f"dispose {frame['dispose_op']}, blend {frame['blend_op']}"
+        )
+    return "\n".join(lines)
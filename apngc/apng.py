@@ -6,23 +6,64 @@ import re
 import shutil
 import subprocess
 import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import tinify
 from PySide6.QtCore import QObject, Signal
 
 from .constants import APNGASM_PATH, FFMPEG_PATH
+from .journal import DONE, FAILED, STARTED
 
 # LOGGING
 LOGGER = logging.getLogger(__name__)
 
+# Number of processors currently running, to share the cores between them
+_active_jobs = 0
+_active_jobs_lock = threading.Lock()
+# tinify keeps its key globally, jobs running in parallel may use other keys
+_tinify_lock = threading.Lock()
+
+# RESIZING
+MIN_SHARD_FRAMES = 50  # don't split sequences into smaller frame ranges
+
+# INPUTS, all formats ffmpeg can decode and convert to PNG
+SEQUENCE_EXTENSIONS = [
+    "png", "exr", "jpg", "jpeg", "tif", "tiff", "tga", "dpx", "bmp", "webp"
+]
+VIDEO_EXTENSIONS = ["mp4", "mov", "webm", "mkv", "avi", "m4v", "gif"]
+
+
+def get_ffmpeg_exe(name="ffmpeg"):
+    """Returns the path to the bundled ffmpeg (or ffprobe) executable"""
+    if os.name == "nt":
+        return os.path.join(FFMPEG_PATH, name + ".exe")
+    return os.path.join(FFMPEG_PATH, name)
+
+
+def is_video(path):
+    """Returns whether the path is a video file instead of a folder"""
+    return (
+        os.path.isfile(path)
+        and path.rsplit(".", 1)[-1].lower() in VIDEO_EXTENSIONS
+    )
+
 
 def get_image_size(image_path):
-    ffprobe_exe = os.path.join(FFMPEG_PATH, "ffprobe.exe")
-    if os.name != "nt":  # macOS or Linux
-        ffprobe_exe = ffprobe_exe.split(".exe")[0]
+    if image_path.lower().endswith(".png"):
+        # Read the size straight from the IHDR chunk, no need for ffprobe
+        with open(image_path, "rb") as f:
+            header = f.read(24)
+        if header[:8] == b"\x89PNG\r\n\x1a\n" and header[12:16] == b"IHDR":
+            return (
+                int.from_bytes(header[16:20], "big"),
+                int.from_bytes(header[20:24], "big"),
+            )
 
     ffprobe_cmd = [
-        ffprobe_exe,
+        get_ffmpeg_exe("ffprobe"),
         "-v",
         "error",
         "-select_streams",
@@ -48,6 +89,51 @@ def get_image_size(image_path):
         return None
 
 
+def get_video_info(video):
+    """Returns the size, frame rate and number of frames of a video.
+
+    Only reads the container headers, the number of frames is estimated
+    from the duration when the container doesn't store it.
+
+    Returns:
+        info (dict): with `width`, `height`, `fps` and `frames`, or None.
+    """
+    ffprobe_cmd = [
+        get_ffmpeg_exe("ffprobe"),
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=width,height,r_frame_rate,nb_frames,duration",
+        "-of",
+        "json",
+        video,
+    ]
+    try:
+        result = subprocess.check_output(ffprobe_cmd)
+        stream = json.loads(result)["streams"][0]
+        numerator, denominator = stream["r_frame_rate"].split("/")
+        fps = float(numerator) / float(denominator)
+        frames = stream.get("nb_frames")
+        if frames and frames != "N/A":
+            frames = int(frames)
+        else:
+            frames = int(float(stream.get("duration", 0)) * fps)
+        return {
+            "width": int(stream["width"]),
+            "height": int(stream["height"]),
+            "fps": fps,
+            "frames": frames,
+        }
+    except subprocess.CalledProcessError as e:
+        LOGGER.error(e.output)
+        return None
+    except Exception as e:
+        LOGGER.error(e)
+        return None
+
+
 def get_image_sequence(seq):
     """Gets all of the files in an image sequence.
 
@@ -106,41 +192,248 @@ def get_first_frame(file_path, number=False):
         return None
 
 
-def resize(seq, start_frame, width, height):
+def make_temp_dir(name):
+    """Creates a unique temporary directory for intermediate frames.
+
+    Unique per call so concurrent jobs with the same sequence name never
+    share (or delete) each other's frames.
+    """
+    temp_dir = os.path.join(tempfile.gettempdir(), "apng")
+    os.makedirs(temp_dir, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"{name}_", dir=temp_dir)
+
+
+def get_resampled_frames(count, source_framerate, framerate):
+    """Returns the indices of the source frames shown at `framerate`.
+
+    Each output frame shows the last source frame started at its time, so
+    lowering the frame rate drops frames and raising it repeats them.
+
+    Args:
+        count (int): the number of source frames.
+        source_framerate (float): the frame rate of the source frames.
+        framerate (float): the frame rate to resample to.
+    Returns:
+        indices (lst): the source frame index of each output frame.
+    """
+    if not source_framerate or not framerate or (
+        source_framerate == framerate
+    ):
+        return list(range(count))
+
+    frames = max(1, round(count * framerate / source_framerate))
+    return [
+        min(count - 1, int(index * source_framerate / framerate + 1e-9))
+        for index in range(frames)
+    ]
+
+
+def get_shard_count(frames, threads=None):
+    """Returns in how many shards to split resizing a sequence.
+
+    Without a thread count the available cores are divided over the jobs
+    running at the same time. Each shard should hold at least
+    MIN_SHARD_FRAMES frames, so small sequences keep using a single ffmpeg
+    process.
+    """
+    if not frames:
+        return 1
+    if not threads:
+        cores = os.cpu_count() or 1
+        with _active_jobs_lock:
+            threads = cores // max(1, _active_jobs)
+    return max(1, min(threads, frames // MIN_SHARD_FRAMES))
+
+
+def resize(seq, start_frame, width, height, frames=None, filters=None,
+           shards=None, threads=None, source_framerate=None, framerate=None):
     """Resizes all of the files in an image sequence.
 
+    The result is always a PNG sequence, whatever the input format. Long
+    sequences are split into frame ranges that are resized by several
+    ffmpeg processes in parallel, writing to the same output numbering.
+
     Args:
         seq (str): a string representing a frame of an image sequence.
         start_frame (int): the first frame of the image sequence.
         width (int): the width to resize the sequence to
         height (int): the height to resize the sequence to
+        frames (int): the number of frames to resize, defaults to all.
+        filters (lst): ffmpeg filters to use instead of the plain scale,
+            e.g. from `trim.get_trim_filters`.
+        shards (int): the number of parallel ffmpeg processes, defaults
+            to `get_shard_count`. Requires `frames`.
+        threads (int): the total number of threads to use over all
+            shards, defaults to letting ffmpeg decide.
+        source_framerate (float): the frame rate of the sequence, with
+            `framerate` the frames are blended to that frame rate before
+            resizing. Uses a single shard.
+        framerate (float): the frame rate to blend to.
 
     Returns:
         out (str): a string representing the resulting image sequence.
     """
-    LOGGER.info(f"Resizing {seq} to {width}x{height}")
-    temp_dir = tempfile.gettempdir()
     name = os.path.basename(seq).split("%")[0][:-1]
-    out_dir = os.path.join(temp_dir, "apng", name)
-    if os.path.exists(out_dir):
-        shutil.rmtree(out_dir)
-    os.makedirs(out_dir)
-    out = os.path.join(out_dir, os.path.basename(seq))
+    out_dir = make_temp_dir(name)
+    out_name = os.path.splitext(os.path.basename(seq))[0] + ".png"
+    out = os.path.join(out_dir, out_name)
+
+    if not filters:
+        filters = [f"scale={width}:{height}:flags=lanczos"]
+    if source_framerate and framerate:
+        filters = [f"framerate=fps={framerate}"] + filters
+        # The output frames don't map to ranges of input frames
+        shards = 1
+        frames = None
+
+    if not frames:
+        shards = 1
+    elif not shards:
+        shards = get_shard_count(frames, threads)
+    shards = min(shards, frames or 1)
+    shard_threads = max(1, threads // shards) if threads else None
+
+    LOGGER.info(f"Resizing {seq} to {width}x{height} in {shards} shard(s)")
+    commands = []
+    shard_size = -(-frames // shards) if frames else None
+    for shard in range(shards):
+        offset = shard * shard_size if frames else 0
+        count = min(shard_size, frames - offset) if frames else None
+        commands.append(
+            _get_resize_cmd(seq, start_frame + offset, filters, count,
+                            out, 1 + offset, shard_threads, source_framerate)
+        )
 
-    ffmpeg_exe = os.path.join(FFMPEG_PATH, "ffmpeg.exe")
-    if os.name != "nt":  # macOS or Linux
-        ffmpeg_exe = ffmpeg_exe.split(".exe")[0]
+    if len(commands) == 1:
+        subprocess.call(commands[0], shell=True)
+    else:
+        with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+            list(executor.map(
+                lambda cmd: subprocess.call(cmd, shell=True), commands
+            ))
+
+    return out
+
+
+def _get_resize_cmd(seq, start_frame, filters, frames, out, out_start,
+                    threads=None, source_framerate=None):
+    # Convert other formats (EXR, JPG, ...) to 8-bit RGBA PNG
+    pix_fmt = "" if seq.lower().endswith(".png") else " -pix_fmt rgba"
 
-    ffmpeg_cmd = '"{ffmpeg_exe}" -y -start_number {start_frame} -i "{seq}" -vf "scale={width}:{height}:flags=lanczos" "{out}"'.format(
-        ffmpeg_exe=ffmpeg_exe,
+    ffmpeg_cmd = '"{ffmpeg_exe}" -y{threads}{framerate} -start_number {start_frame} -i "{seq}" -vf "{filters}"{out_threads}{frames}{pix_fmt} -start_number {out_start} "{out}"'.format(
+        ffmpeg_exe=get_ffmpeg_exe(),
+        threads=_get_threads_args(threads),
+        framerate=(
+            f" -framerate {source_framerate}" if source_framerate else ""
+        ),
         start_frame=start_frame,
         seq=seq,
-        width=width,
-        height=height,
+        filters=",".join(filters),
+        out_threads=f" -threads {threads}" if threads else "",
+        frames=f" -frames:v {frames}" if frames else "",
+        pix_fmt=pix_fmt,
+        out_start=out_start,
         out=out,
     )
     LOGGER.debug(f'FFMPEG Resizing Command: "{ffmpeg_cmd}"')
-    subprocess.call(ffmpeg_cmd, shell=True)
+    return ffmpeg_cmd
+
+
+def _get_threads_args(threads):
+    """Returns the ffmpeg input arguments limiting the threads of the
+    decoder and the filters. The encoder is limited by passing `-threads`
+    again as an output option."""
+    if not threads:
+        return ""
+    return f" -threads {threads} -filter_threads {threads}"
+
+
+def get_video_filters(framerate, frame_start=None, frame_end=None,
+                      source_framerate=None, blend=False):
+    """Returns the ffmpeg filters selecting the frames used from a video.
+
+    The `fps` filter drops (or repeats) frames to the frame rate before
+    any later filter, so dropped frames are never resized. With `blend`
+    the `framerate` filter blends neighbouring frames instead. The frame
+    rate of the video is probed from its timestamps unless
+    `source_framerate` is given.
+    """
+    filters = []
+    if frame_start is not None or frame_end is not None:
+        trim = [f"start_frame={frame_start or 0}"]
+        if frame_end is not None:
+            trim.append(f"end_frame={frame_end + 1}")
+        filters.append("trim=" + ":".join(trim))
+        if not source_framerate:
+            filters.append("setpts=PTS-STARTPTS")
+    if source_framerate:
+        filters.append(f"setpts=N/({source_framerate}*TB)")
+    if framerate:
+        if blend:
+            filters.append(f"framerate=fps={framerate}")
+        else:
+            filters.append(f"fps={framerate}")
+    return filters
+
+
+def decode_video(video, width, height, framerate, frame_start=None,
+                 frame_end=None, filters=None, threads=None,
+                 source_framerate=None, blend=False):
+    """Decodes a video straight into a resized PNG sequence.
+
+    Decoding, frame range selection, frame rate conversion and resizing
+    all happen in a single streaming ffmpeg pass, so no full resolution
+    frames are ever written to disk.
+
+    Args:
+        video (str): the path to the video file.
+        width (int): the width to resize the frames to
+        height (int): the height to resize the frames to
+        framerate (int): the frame rate to sample the video at
+        frame_start (int): the first video frame to use, defaults to 0.
+        frame_end (int): the last video frame to use (inclusive),
+            defaults to the end of the video.
+        filters (lst): ffmpeg filters to use instead of the plain scale,
+            e.g. from `trim.get_trim_filters`.
+        threads (int): the number of threads to use, defaults to letting
+            ffmpeg decide.
+        source_framerate (float): the frame rate to play the video at,
+            instead of the one of its timestamps.
+        blend (bool): blend frames to the frame rate instead of dropping
+            or repeating them.
+
+    Returns:
+        out (str): a string representing the resulting image sequence.
+    """
+    LOGGER.info(f"Decoding {video} to {width}x{height} at {framerate} fps")
+    name = os.path.splitext(os.path.basename(video))[0]
+    out = os.path.join(make_temp_dir(name), f"{name}_%04d.png")
+
+    if not filters:
+        filters = [f"scale={width}:{height}:flags=lanczos"]
+    filters = get_video_filters(
+        framerate, frame_start, frame_end, source_framerate, blend
+    ) + filters
+
+    ffmpeg_cmd = [
+        get_ffmpeg_exe(),
+        "-y",
+        *_get_threads_args(threads).split(),
+        "-i",
+        video,
+        "-vf",
+        ",".join(filters),
+        *(["-threads", str(threads)] if threads else []),
+        "-pix_fmt",
+        "rgba",
+        "-start_number",
+        "1",
+        out,
+    ]
+    LOGGER.debug(
+        f"FFMPEG Decoding Command: {subprocess.list2cmdline(ffmpeg_cmd)}"
+    )
+    subprocess.call(ffmpeg_cmd)
 
     return out
 
@@ -155,14 +448,14 @@ def tinify_apng(src_apng, key, overwrite=True):
     """
     LOGGER.info(f"Optimizing {src_apng} with tinify")
 
-    tinify.key = key
-
     if overwrite:
         dst_apng = src_apng
     else:
         dst_apng = src_apng.replace(".apng", "_opt.apng")
 
-    tinify.from_file(src_apng).to_file(dst_apng)
+    with _tinify_lock:
+        tinify.key = key
+        tinify.from_file(src_apng).to_file(dst_apng)
 
 
 def assemble_apng(out_filename, in_filename, framerate, loops):
@@ -192,27 +485,96 @@ def assemble_apng(out_filename, in_filename, framerate, loops):
     
 
 class APNGProcessorHeadless:
-    def __init__(self, seq_dir, settings):
+    def __init__(self, seq_dir, settings, journal=None, budget=None,
+                 shared_frames=None, frame_cache=None):
         super().__init__()
 
         self.seq_dir = seq_dir
         self.settings = settings
+        self.journal = journal
+        self.budget = budget
+        self.shared_frames = shared_frames
+        self.frame_cache = frame_cache
+        self.reservation = None
+        self.reservation_wait = 0
+        self.threads = None
         self.temp_resized_seq = None
+        self.temp_resampled_dir = None
         self.files = []
         self.temp_hold_file = None
+        self.temp_out_filename = None
+        self.out_filename = None
+        self.format_executor = None
+        self.format_futures = {}
+        self.format_input_args = None
+        self.temp_format_files = {}
+        self.format_report = None
 
     def iter_process(self):
-        yield 0
-        self.files = self._get_image_files()
-        if len(self.files) < 2:
-            LOGGER.error(
-                f"Less than 2 files detected in {self.seq_dir}, skipping..."
+        global _active_jobs
+        with _active_jobs_lock:
+            _active_jobs += 1
+        try:
+            yield from self._iter_journaled()
+        finally:
+            with _active_jobs_lock:
+                _active_jobs -= 1
+            self._release_resources()
+
+    def _iter_journaled(self):
+        from .estimate import record_run
+
+        start = time.monotonic()
+        if self.journal:
+            self.journal.record(self.seq_dir, self.settings, STARTED)
+        try:
+            yield from self._iter_process()
+        except Exception as e:
+            self._cleanup_temp_files()
+            if self.journal:
+                self.journal.record(
+                    self.seq_dir, self.settings, FAILED, error=str(e)
+                )
+            raise
+
+        if self.journal:
+            fields = {}
+            if self.format_report:
+                fields["formats"] = self.format_report
+            self.journal.record(
+                self.seq_dir, self.settings, DONE, output=self.out_filename,
+                **fields,
             )
-            raise Exception("No sequence!")
+        # Calibrate with the processing time only, not the time spent
+        # queued for the budget
+        record_run(
+            self.seq_dir, self.settings, self.out_filename,
+            time.monotonic() - start - self.reservation_wait,
+        )
 
-        start_frame = self._get_start_frame(self.files[0])
-        basename = self._get_basename(start_frame)
-        self.seq = self._determine_sequence(basename, self.files)
+    def _iter_process(self):
+        yield 0
+        if is_video(self.seq_dir):
+            basename, self.seq = self._decode_video()
+        else:
+            self.files = self._get_image_files()
+            if len(self.files) < 2:
+                LOGGER.error(
+                    f"Less than 2 files detected in {self.seq_dir}, "
+                    "skipping..."
+                )
+                raise Exception("No sequence!")
+
+            start_frame = self._get_start_frame(self.files[0])
+            basename = self._get_basename(start_frame)
+            self.seq = self._determine_sequence(basename, self.files)
+
+        if len(get_image_sequence(self.seq)) < 2:
+            raise Exception(f"No frames decoded from {self.seq_dir}")
+
+        stages = self._get_frame_stages()
+        if stages:
+            self.seq = self._apply_frame_stages(stages)
         yield 20
 
         if self.settings.get("hold"):
@@ -220,13 +582,21 @@ class APNGProcessorHeadless:
             self._hold()
         yield 20
 
+        self._start_other_formats(basename)
         out_filename = self._assemble_apng(self.seq, basename)
         yield 20
 
-        if self.settings.get("optimize"):
-            self._optimize_apng(out_filename)
+        # Don't spend tinify credits on an APNG that can't be kept
+        if self._is_apng_allowed():
+            if self.settings.get("optimize"):
+                self._optimize_apng(out_filename)
+            # After tinify, which re-encodes the frames with its own deflate
+            if self.settings.get("recompress"):
+                self._recompress_apng(out_filename)
         yield 20
 
+        self._select_format()
+        self._publish_apng()
         self._cleanup_temp_files()
         yield 20
         LOGGER.info(f"Finished processing {self.seq_dir}")
@@ -248,13 +618,113 @@ class APNGProcessorHeadless:
         self.temp_hold_file = delay_file
 
     def _get_image_files(self):
-        extensions = ["png"]
-        return sorted(
-            [
+        files = {}
+        for filename in os.listdir(self.seq_dir):
+            ext = filename.rsplit(".", 1)[-1].lower()
+            if "." in filename and ext in SEQUENCE_EXTENSIONS:
+                files.setdefault(ext, []).append(filename)
+        if not files:
+            return []
+
+        # Use the most common format if the folder holds several
+        files = sorted(max(files.values(), key=len))
+
+        frame_start = self.settings.get("frame_start")
+        frame_end = self.settings.get("frame_end")
+        if frame_start is not None or frame_end is not None:
+            files = [
                 filename
-                for filename in os.listdir(self.seq_dir)
-                if any(filename.endswith(ext) for ext in extensions)
+                for filename in files
+                if self._in_frame_range(filename, frame_start, frame_end)
             ]
+        return files
+
+    def _in_frame_range(self, filename, frame_start, frame_end):
+        try:
+            frame = int(self._get_start_frame(filename))
+        except ValueError:
+            return False
+        if frame_start is not None and frame < frame_start:
+            return False
+        if frame_end is not None and frame > frame_end:
+            return False
+        return True
+
+    def _decode_video(self):
+        name = os.path.splitext(os.path.basename(self.seq_dir))[0]
+        info = get_video_info(self.seq_dir)
+        if info:
+            self._reserve_resources(
+                (info["width"], info["height"]), info["frames"]
+            )
+
+        filters = None
+        if self.settings.get("trim") and info:
+            dimensions = (info["width"], info["height"])
+            input_args = ["-i", self.seq_dir]
+            pre_filters = get_video_filters(
+                self.settings.get("framerate"),
+                self.settings.get("frame_start"),
+                self.settings.get("frame_end"),
+                self.settings.get("source_framerate"),
+                self.settings.get("resample") == "blend",
+            )
+            filters = self._get_trim_filters(
+                input_args, dimensions, pre_filters
+            )
+
+        self.temp_resized_seq = decode_video(
+            self.seq_dir,
+            self.settings.get("width"),
+            self.settings.get("height"),
+            self.settings.get("framerate"),
+            frame_start=self.settings.get("frame_start"),
+            frame_end=self.settings.get("frame_end"),
+            filters=filters,
+            threads=self.threads,
+            source_framerate=self.settings.get("source_framerate"),
+            blend=self.settings.get("resample") == "blend",
+        )
+        return f"{name}_%04d.png", self.temp_resized_seq
+
+    def _reserve_resources(self, source_size, frames):
+        """Waits for the budget to admit this job and takes its share of
+        threads and memory."""
+        if not self.budget:
+            return
+
+        size = (self.settings.get("width"), self.settings.get("height"))
+        threads, memory = self.budget.fit(source_size, size, frames)
+        start = time.monotonic()
+        self.reservation = self.budget.acquire(threads, memory)
+        self.reservation_wait = time.monotonic() - start
+        self.threads = self.reservation[0]
+
+    def _release_resources(self):
+        if self.reservation:
+            self.budget.release(*self.reservation)
+            self.reservation = None
+
+    def _get_trim_filters(self, input_args, dimensions, pre_filters=None):
+        """Returns the filters cropping away the transparent borders shared
+        by all frames, or None when there is nothing to trim."""
+        from .trim import get_alpha_bbox, get_trim_filters
+
+        if not dimensions:
+            return None
+
+        bbox = get_alpha_bbox(
+            input_args, dimensions[0], dimensions[1], filters=pre_filters
+        )
+        if not bbox or bbox == (0, 0, dimensions[0], dimensions[1]):
+            return None
+
+        return get_trim_filters(
+            bbox,
+            dimensions,
+            self.settings.get("width"),
+            self.settings.get("height"),
+            pad=self.settings.get("trim_pad"),
         )
 
     def _get_start_frame(self, filename):
@@ -271,46 +741,429 @@ class APNGProcessorHeadless:
 
     def _determine_sequence(self, basename, files):
         dimensions = get_image_size(os.path.join(self.seq_dir, files[0]))
-        if not dimensions or (
+        is_range = (
+            self.settings.get("frame_start") is not None
+            or self.settings.get("frame_end") is not None
+        )
+        source_framerate = self.settings.get("source_framerate")
+        framerate = self.settings.get("framerate")
+        blend = (
+            source_framerate and source_framerate != framerate
+            and self.settings.get("resample") == "blend"
+        )
+        if source_framerate and not blend:
+            # Only the frames that are shown are resized
+            files = [
+                files[index] for index in get_resampled_frames(
+                    len(files), source_framerate, framerate
+                )
+            ]
+            LOGGER.info(
+                f"Resampled {len(self.files)} frames from {source_framerate} "
+                f"to {framerate} fps into {len(files)} frames"
+            )
+        if files != self.files or (blend and is_range):
+            # Frames that aren't the whole folder are linked into a
+            # contiguous sequence, so ffmpeg reads exactly those frames
+            files = self._link_resampled(basename, files)
+            is_range = False
+
+        seq_dir = self.temp_resampled_dir or self.seq_dir
+        seq = os.path.join(seq_dir, basename)
+        start_frame = int(self._get_start_frame(files[0]))
+        if dimensions:
+            self._reserve_resources(dimensions, len(files))
+
+        filters = None
+        if self.settings.get("trim"):
+            input_args = ["-start_number", str(start_frame), "-i", seq,
+                          "-frames:v", str(len(files))]
+            filters = self._get_trim_filters(input_args, dimensions)
+
+        is_png = files[0].lower().endswith(".png")
+        if not dimensions or not is_png or is_range or filters or blend or (
             dimensions[0] != self.settings.get("width")
             or dimensions[1] != self.settings.get("height")
         ):
-            self.temp_resized_seq = resize(
-                os.path.join(self.seq_dir, basename),
-                get_first_frame(os.path.join(self.seq_dir, basename), 1),
-                self.settings.get("width"),
-                self.settings.get("height"),
-            )
+            if self.shared_frames and not blend:
+                paths = [os.path.join(seq_dir, filename) for filename in files]
+                self.temp_resized_seq = self._resize_shared(
+                    seq, paths, filters
+                )
+            elif blend:
+                LOGGER.info(
+                    f"Blending {seq} from {source_framerate} "
+                    f"to {framerate} fps"
+                )
+                self.temp_resized_seq = resize(
+                    seq,
+                    start_frame,
+                    self.settings.get("width"),
+                    self.settings.get("height"),
+                    filters=filters,
+                    threads=self.threads,
+                    source_framerate=source_framerate,
+                    framerate=framerate,
+                )
+            else:
+                self.temp_resized_seq = resize(
+                    seq,
+                    start_frame,
+                    self.settings.get("width"),
+                    self.settings.get("height"),
+                    frames=len(files),
+                    filters=filters,
+                    threads=self.threads,
+                )
             return self.temp_resized_seq
         else:
-            return os.path.join(self.seq_dir, basename)
+            return seq
+
+    def _link_resampled(self, basename, files):
+        """Links frames into a temporary sequence numbered from 1, named
+        like the source. Returns the linked filenames."""
+        from .dedup import link_or_copy
+
+        LOGGER.debug(f"Linking {len(files)} frames of {self.seq_dir}")
+        name = basename.split("%")[0][:-1]
+        self.temp_resampled_dir = make_temp_dir(name)
+        linked = []
+        for index, filename in enumerate(files):
+            link_or_copy(
+                os.path.join(self.seq_dir, filename),
+                os.path.join(self.temp_resampled_dir, basename % (index + 1)),
+            )
+            linked.append(basename % (index + 1))
+        return linked
+
+    def _resize_shared(self, seq, paths, filters):
+        """Resizes only the frames not resized before in this batch.
+
+        Unique missing frames are linked into a contiguous temporary
+        sequence and resized together, then every frame of the result is
+        linked from the shared frame store.
+        """
+        from .dedup import link_or_copy
+
+        width = self.settings.get("width")
+        height = self.settings.get("height")
+        params = f"{width}x{height}:{','.join(filters or [])}"
+        keys = [
+            (frame_hash, params)
+            for frame_hash in self.shared_frames.hash_files(paths)
+        ]
+
+        missing = {}
+        for key, path in zip(keys, paths):
+            if key not in missing and not self.shared_frames.get(key):
+                missing[key] = path
+
+        name = os.path.basename(seq).split("%")[0][:-1]
+        if missing:
+            LOGGER.info(
+                f"Resizing {len(missing)} unique new frame(s) "
+                f"out of {len(paths)} of {seq}"
+            )
+            ext = os.path.splitext(paths[0])[1]
+            src_dir = make_temp_dir(name)
+            src_seq = os.path.join(src_dir, f"{name}_%06d{ext}")
+            resized = None
+            try:
+                for index, path in enumerate(missing.values()):
+                    link_or_copy(path, src_seq % (index + 1))
+
+                resized = resize(src_seq, 1, width, height,
+                                 frames=len(missing), filters=filters,
+                                 threads=self.threads)
+                for index, key in enumerate(missing):
+                    self.shared_frames.add(key, resized % (index + 1))
+            finally:
+                shutil.rmtree(src_dir, ignore_errors=True)
+                if resized:
+                    shutil.rmtree(os.path.dirname(resized), ignore_errors=True)
+        else:
+            LOGGER.info(f"All frames of {seq} were resized before")
+
+        out_name = os.path.splitext(os.path.basename(seq))[0] + ".png"
+        out_dir = make_temp_dir(name)
+        out = os.path.join(out_dir, out_name)
+        try:
+            for index, key in enumerate(keys):
+                link_or_copy(self.shared_frames.get(key), out % (index + 1))
+        except Exception:
+            shutil.rmtree(out_dir, ignore_errors=True)
+            raise
+        return out
+
+    def get_output_filename(self):
+        """Returns the path the APNG will be written to"""
+        if is_video(self.seq_dir):
+            name = os.path.splitext(os.path.basename(self.seq_dir))[0]
+        else:
+            files = self.files or self._get_image_files()
+            if not files:
+                return None
+            start_frame = self._get_start_frame(files[0])
+            name = replace_last_occurrence(
+                files[0], start_frame, "%"
+            ).split("%")[0][:-1]
+        return os.path.normpath(
+            os.path.join(self.settings.get("output_path"), name + ".png")
+        )
+
+    def _get_frame_stages(self):
+        """Returns the in-memory stages each resized frame goes through"""
+        stages = []
+        if self.settings.get("denoise"):
+            from .denoise import TemporalDenoise
+
+            stages.append(TemporalDenoise(self.settings["denoise"]))
+        return stages
+
+    def _apply_frame_stages(self, stages):
+        """Runs the resized frames through the in-memory stages.
+
+        Frames stream through a FramePipeline so at most
+        `max_frames_in_flight` of them are in memory at once, regardless
+        of the sequence length.
+        """
+        from .frames import FramePipeline
+
+        files = get_image_sequence(self.seq)
+        width, height = get_image_size(files[0])
+        name = os.path.basename(self.seq).split("%")[0][:-1]
+        out = os.path.join(
+            make_temp_dir(name), os.path.basename(self.seq)
+        )
+        start_frame = int(self._get_start_frame(os.path.basename(files[0])))
+
+        pipeline = FramePipeline(
+            stages, self.settings.get("max_frames_in_flight"),
+            threads=self.threads,
+        )
+        pipeline.run(
+            ["-start_number", str(start_frame), "-i", self.seq,
+             "-frames:v", str(len(files))],
+            width,
+            height,
+            out,
+        )
+
+        if self.temp_resized_seq:
+            shutil.rmtree(os.path.dirname(self.temp_resized_seq))
+        self.temp_resized_seq = out
+        return out
 
     def _assemble_apng(self, seq, basename):
         out_dir = self.settings.get("output_path")
         if not os.path.exists(out_dir):
             os.makedirs(out_dir)
 
-        out_filename = os.path.normpath(
-            os.path.join(out_dir, basename.split("%")[0][:-1] + ".png")
+        name = basename.split("%")[0][:-1]
+        self.out_filename = os.path.normpath(
+            os.path.join(out_dir, name + ".png")
         )
 
+        # Write to a hidden temporary file that only replaces the output
+        # once complete, so a killed process never leaves a partial APNG
+        temp_name = f".{name}.{uuid.uuid4().hex[:8]}.partial.png"
+        self.temp_out_filename = os.path.join(out_dir, temp_name)
+
         assemble_apng(
-            out_filename,
+            self.temp_out_filename,
             get_first_frame(seq),
             self.settings.get("framerate"),
             self.settings.get("loops"),
         )
+        if not os.path.isfile(self.temp_out_filename):
+            raise RuntimeError(f"APNGASM failed to write {self.out_filename}")
+
+        return self.temp_out_filename
+
+    def _start_other_formats(self, basename):
+        """Starts encoding the frames to the other output formats of the
+        settings in the background, while the APNG is made."""
+        from .formats import APNG, ENCODERS, EXTENSIONS
+
+        formats = [
+            output_format
+            for output_format in self.settings.get("formats") or []
+            if output_format != APNG
+        ]
+        if not formats:
+            return
+
+        out_dir = self.settings.get("output_path")
+        os.makedirs(out_dir, exist_ok=True)
+        name = basename.split("%")[0][:-1]
+        files = get_image_sequence(self.seq)
+        start_frame = int(self._get_start_frame(os.path.basename(files[0])))
+        self.format_input_args = ["-start_number", str(start_frame),
+                                  "-i", self.seq, "-frames:v", str(len(files))]
+
+        self.format_executor = ThreadPoolExecutor(max_workers=len(formats))
+        for output_format in formats:
+            temp_name = (
+                f".{name}.{uuid.uuid4().hex[:8]}.partial"
+                f"{EXTENSIONS[output_format]}"
+            )
+            temp_filename = os.path.join(out_dir, temp_name)
+            self.temp_format_files[output_format] = temp_filename
+            self.format_futures[output_format] = self.format_executor.submit(
+                self._encode_format,
+                ENCODERS[output_format],
+                output_format,
+                temp_filename,
+            )
+
+    def _is_apng_allowed(self):
+        """Returns whether the settings allow an APNG output"""
+        from .formats import APNG
+
+        return APNG in (self.settings.get("formats") or [APNG])
+
+    def _encode_format(self, encoder, output_format, filename):
+        """Encodes the frames, returns the SSIM if it's needed"""
+        from .formats import LOSSLESS, get_ssim
+
+        LOGGER.info(f"Encoding {self.seq} as {output_format}")
+        framerate = self.settings.get("framerate")
+        encoder(
+            self.format_input_args,
+            filename,
+            framerate,
+            self.settings.get("loops"),
+            hold=self.settings.get("hold"),
+        )
+        if not os.path.isfile(filename):
+            raise RuntimeError(f"FFMPEG failed to write {filename}")
+
+        if output_format in LOSSLESS:
+            return 1.0
+        if self.settings.get("min_ssim"):
+            return get_ssim(filename, self.format_input_args, framerate)
+        return None
+
+    def _select_format(self):
+        """Keeps the smallest output format that meets the quality floor.
+
+        APNG is kept when no other format is smaller, or none meets
+        `min_ssim` and APNG is one of the `formats`. The size (and SSIM) of
+        every format is logged and kept in `format_report`.
+
+        Raises:
+            RuntimeError: if no format of the settings can be kept.
+        """
+        from .formats import APNG, EXTENSIONS, get_ssim
+
+        if not self.format_futures:
+            return
+
+        min_ssim = self.settings.get("min_ssim")
+        apng_ssim = 1.0
+        if self.settings.get("optimize"):
+            # tinify quantizes colors
+            apng_ssim = None
+            if min_ssim:
+                apng_ssim = get_ssim(
+                    self.temp_out_filename,
+                    self.format_input_args,
+                    self.settings.get("framerate"),
+                )
+        report = {
+            APNG: {
+                "bytes": os.path.getsize(self.temp_out_filename),
+                "ssim": apng_ssim,
+            }
+        }
+        for output_format, future in self.format_futures.items():
+            try:
+                ssim = future.result()
+            except Exception as e:
+                LOGGER.warning(
+                    f"Could not encode {self.seq_dir} as {output_format}: {e}"
+                )
+                continue
+            report[output_format] = {
+                "bytes": os.path.getsize(
+                    self.temp_format_files[output_format]
+                ),
+                "ssim": ssim,
+            }
+        self.format_futures = {}
+
+        allowed = self.settings.get("formats")
+        eligible = [
+            output_format
+            for output_format, entry in report.items()
+            if output_format in allowed
+            and (not min_ssim or (entry["ssim"] or 0) >= min_ssim)
+        ]
+        if not eligible:
+            if not self._is_apng_allowed():
+                raise RuntimeError(
+                    f"No format of {self.seq_dir} meets the quality floor "
+                    f"of {min_ssim}"
+                )
+            LOGGER.warning(
+                f"No format of {self.seq_dir} meets the quality floor of "
+                f"{min_ssim}, keeping {APNG}"
+            )
+            eligible = [APNG]
+        chosen = min(eligible, key=lambda fmt: report[fmt]["bytes"])
+        self.format_report = {"chosen": chosen, "sizes": report}
+
+        LOGGER.info(
+            f"Output formats of {self.seq_dir}: "
+            + ", ".join(
+                f"{output_format} {entry['bytes']} bytes"
+                + (f" (SSIM {entry['ssim']:.4f})" if entry["ssim"] else "")
+                for output_format, entry in report.items()
+            )
+            + f", keeping {chosen}"
+        )
+
+        if chosen != APNG:
+            os.remove(self.temp_out_filename)
+            self.temp_out_filename = self.temp_format_files.pop(chosen)
+            self.out_filename = (
+                os.path.splitext(self.out_filename)[0] + EXTENSIONS[chosen]
+            )
 
-        return out_filename
+    def _publish_apng(self):
+        os.replace(self.temp_out_filename, self.out_filename)
+        self.temp_out_filename = None
+
+    def _recompress_apng(self, out_filename):
+        from .optimize import optimize_apng
+
+        optimize_apng(
+            out_filename, processes=self.threads, cache=self.frame_cache
+        )
 
     def _optimize_apng(self, out_filename):
         tinify_apng(out_filename, self.settings.get("tinify_key"))
 
     def _cleanup_temp_files(self):
+        if self.format_executor:
+            self.format_executor.shutdown(wait=True)
+            self.format_executor = None
+            self.format_futures = {}
+        for temp_filename in self.temp_format_files.values():
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+        self.temp_format_files = {}
+        if self.temp_out_filename and os.path.exists(self.temp_out_filename):
+            os.remove(self.temp_out_filename)
         if self.temp_hold_file:
             os.remove(self.temp_hold_file)
+            self.temp_hold_file = None
         if self.temp_resized_seq:
             shutil.rmtree(os.path.dirname(self.temp_resized_seq))
+            self.temp_resized_seq = None
+        if self.temp_resampled_dir:
+            shutil.rmtree(self.temp_resampled_dir)
+            self.temp_resampled_dir = None
 
 
 class APNGProcessor(QObject):
@@ -318,10 +1171,12 @@ class APNGProcessor(QObject):
     progress_changed = Signal(int)  # THIS RETURNS INCREMENTAL PROGRESS
     absolute_progress_changed = Signal(int)  # THIS RETURNS AN ABSOLUTE 0-100
 
-    def __init__(self, seq_dir, settings):
+    def __init__(self, seq_dir, settings, journal=None, budget=None):
         super().__init__()
         self.absolute_progress = 0
-        self._headless_processor = APNGProcessorHeadless(seq_dir, settings)
+        self._headless_processor = APNGProcessorHeadless(
+            seq_dir, settings, journal=journal, budget=budget
+        )
 
     def process(self):
         for progress in self._headless_processor.iter_process():
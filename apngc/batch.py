@@ -0,0 +1,118 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .apng import APNGProcessorHeadless
+from .dedup import SharedFrames, group_duplicates, link_or_copy
+from .journal import DONE, FAILED
+from .preflight import format_preflight, preflight
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+
+def run_batch(seq_dirs, settings, journal=None, budget=None, dedup=True,
+              check=True, frame_cache=None):
+    """Converts several folders with the same settings.
+
+    Folders run side by side as far as the resource budget admits them.
+    With `dedup`, folders holding identical frames are converted once and
+    the output is hardlinked (or copied) for the duplicates, and identical
+    frames are only resized once over the whole batch. With `check`, all
+    folders are preflighted first and rejected folders aren't converted.
+    With a `frame_cache`, frames resized or recompressed by earlier runs
+    are reused, so rebuilds only process the frames that changed.
+
+    Args:
+        seq_dirs (lst): the folders (or video files) to convert.
+        settings (dict): the settings to convert with.
+        journal (Journal): optional journal to record progress in.
+        budget (ResourceBudget): optional budget to share.
+    Returns:
+        failed (lst): the folders that failed or were rejected.
+    """
+    rejected = []
+    if check:
+        seq_dirs, rejected = _preflight(seq_dirs, settings, journal)
+
+    shared = None
+    if dedup or frame_cache:
+        shared = SharedFrames(cache=frame_cache)
+    if dedup:
+        groups = group_duplicates(seq_dirs, settings, shared)
+    else:
+        groups = [[seq_dir] for seq_dir in seq_dirs]
+
+    def process(group):
+        seq_dir, duplicates = group[0], group[1:]
+        processor = APNGProcessorHeadless(
+            seq_dir, settings, journal=journal, budget=budget,
+            shared_frames=shared, frame_cache=frame_cache,
+        )
+        try:
+            processor.process()
+        except Exception as e:
+            LOGGER.error(f"Failed {seq_dir}: {e}")
+            for duplicate in duplicates:
+                if journal:
+                    journal.record(duplicate, settings, FAILED,
+                                   error=str(e), duplicate_of=seq_dir)
+            return group
+
+        for duplicate in duplicates:
+            _materialize_duplicate(
+                processor.out_filename, duplicate, settings, journal,
+                seq_dir,
+            )
+        return []
+
+    max_workers = budget.threads if budget else os.cpu_count()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(process, groups))
+    finally:
+        if shared:
+            shared.cleanup()
+        if frame_cache:
+            LOGGER.info(f"Frame cache: {frame_cache.format_stats()}")
+            frame_cache.evict()
+
+    return rejected + [seq_dir for failed in results for seq_dir in failed]
+
+
+def _preflight(seq_dirs, settings, journal):
+    """Returns the accepted and the rejected folders"""
+    accepted = []
+    rejected = []
+    for report in preflight(seq_dirs, settings):
+        seq_dir = report["folder"]
+        if report["ok"]:
+            if report["warnings"]:
+                LOGGER.warning(format_preflight(report))
+            accepted.append(seq_dir)
+            continue
+
+        LOGGER.error(format_preflight(report))
+        rejected.append(seq_dir)
+        if journal:
+            journal.record(seq_dir, settings, FAILED,
+                           error="; ".join(report["errors"]), preflight=True)
+    return accepted, rejected
+
+
+def _materialize_duplicate(out_filename, seq_dir, settings, journal,
+                           original):
+    duplicate_filename = APNGProcessorHeadless(
+        seq_dir, settings
+    ).get_output_filename()
+    # Keep the format chosen for the original
+    duplicate_filename = (
+        os.path.splitext(duplicate_filename)[0]
+        + os.path.splitext(out_filename)[1]
+    )
+    if duplicate_filename != out_filename:
+        link_or_copy(out_filename, duplicate_filename)
+    LOGGER.info(f"Reused {out_filename} for duplicate {seq_dir}")
+    if journal:
+        journal.record(seq_dir, settings, DONE, output=duplicate_filename,
+                       duplicate_of=original)
@@ -0,0 +1,167 @@
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+from .settings import get_local_settings_path
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+CACHE_SIZE = 2 * 1024 ** 3  # bytes kept on disk before evicting
+RESIZED = "resized"  # resized frames, as PNG files
+COMPRESSED = "compressed"  # recompressed frame data, as zlib streams
+
+
+def get_frame_cache_path():
+    """Returns the directory frames are cached in"""
+    return os.path.join(
+        os.path.dirname(get_local_settings_path()), "frames"
+    )
+
+
+def get_cache_key(*parts):
+    """Returns a cache key for the given parts, e.g. a frame hash and the
+    parameters it was processed with."""
+    digest = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = str(part).encode("utf-8")
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class FrameCache:
+    """Persistent cache of processed frames, shared by all runs.
+
+    Resized frames and recompressed frame data are stored by keys made of
+    the source content and the processing parameters, so a rebuild of a
+    sequence where only some frames changed only processes those frames.
+
+    Entries are files written atomically, so several processes can share
+    the cache. Reading an entry marks it as used, and `evict` removes the
+    least recently used entries over `max_size` bytes.
+    """
+
+    def __init__(self, path=None, max_size=CACHE_SIZE):
+        self.path = path or get_frame_cache_path()
+        self.max_size = max_size
+        self._stats = {RESIZED: [0, 0], COMPRESSED: [0, 0]}
+        self._lock = threading.Lock()
+
+    def _get_entry(self, kind, key):
+        return os.path.join(self.path, kind, key[:2], key)
+
+    def _count(self, kind, hit):
+        with self._lock:
+            self._stats[kind][0 if hit else 1] += 1
+
+    def get_file(self, kind, key):
+        """Returns the path of a cached entry, or None"""
+        entry = self._get_entry(kind, key)
+        try:
+            # Mark as recently used for the LRU eviction
+            os.utime(entry)
+        except OSError:
+            self._count(kind, False)
+            return None
+        self._count(kind, True)
+        return entry
+
+    def get_data(self, kind, key):
+        """Returns the content of a cached entry, or None"""
+        entry = self.get_file(kind, key)
+        if not entry:
+            return None
+        try:
+            with open(entry, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def add_file(self, kind, key, path):
+        """Caches a file, hardlinked unless the cache is on another
+        filesystem."""
+        from .dedup import link_or_copy
+
+        self._add_entry(kind, key, lambda temp_path: link_or_copy(
+            path, temp_path
+        ))
+
+    def add_data(self, kind, key, data):
+        """Caches data"""
+        def write(temp_path):
+            with open(temp_path, "wb") as f:
+                f.write(data)
+
+        self._add_entry(kind, key, write)
+
+    def _add_entry(self, kind, key, write):
+        """Writes an entry atomically with `write(temp_path)`, silently
+        skipped when the cache isn't writable."""
+        entry = self._get_entry(kind, key)
+        temp_path = f"{entry}.{uuid.uuid4().hex}.partial"
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            write(temp_path)
+            os.replace(temp_path, entry)
+        except OSError as e:
+            LOGGER.warning(f"Could not cache frame {key}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def stats(self):
+        """Returns the hits, misses and hit rate per kind of entry"""
+        with self._lock:
+            stats = {}
+            for kind, (hits, misses) in self._stats.items():
+                stats[kind] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": hits / (hits + misses) if hits + misses else 0,
+                }
+            return stats
+
+    def format_stats(self):
+        return ", ".join(
+            f"{kind} {stats['hits']}/{stats['hits'] + stats['misses']} hits "
+            f"({stats['hit_rate']:.0%})"
+            for kind, stats in self.stats().items()
+        )
+
+    def evict(self):
+        """Removes the least recently used entries over `max_size` bytes.
+
+        Returns:
+            removed (int): the number of bytes removed.
+        """
+        entries = []
+        total = 0
+        for root, _dirs, files in os.walk(self.path):
+            for filename in files:
+                if filename.endswith(".partial"):
+                    # Still being written
+                    continue
+                entry = os.path.join(root, filename)
+                try:
+                    stat = os.stat(entry)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+                total += stat.st_size
+
+        removed = 0
+        for _used, size, entry in sorted(entries):
+            if total - removed <= self.max_size:
+                break
+            try:
+                os.remove(entry)
+            except OSError:
+                continue
+            removed += size
+
+        if removed:
+            LOGGER.info(f"Evicted {removed // 1024 ** 2} MB from {self.path}")
+        return removed
@@ -14,3 +14,10 @@ else:  # macOS or Linux
     FFMPEG_PATH = os.path.join(BIN, "ffmpeg")
 
 APNGASM_PATH = os.path.join(BIN, "apngasm")
+
+# OUTPUT FORMATS, APNG is always encoded
+OUTPUT_FORMATS = ["apng", "webp", "gif"]
+
+# SERVER
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
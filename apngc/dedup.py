@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .apng import APNGProcessorHeadless, is_video, make_temp_dir
+from .cache import RESIZED, get_cache_key
+from .journal import settings_hash
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_THREADS = 8
+
+
+def hash_file(path):
+    """Returns the SHA1 of a file's content"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """Hardlinks `src` to `dst`, copying when linking isn't possible.
+
+    Symlinks are resolved first, as a link to a relative symlink would
+    dangle from another directory.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(os.path.realpath(src), dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class SharedFrames:
+    """Frame hashes and resized frames shared by the sequences of a batch.
+
+    Source frames are hashed once per batch (cached by path, size and
+    modification time). Resized frames are kept in a temporary store keyed
+    by source content and resize parameters, so identical frames in
+    different sequences, or repeated within one, are only resized once.
+    With a FrameCache, resized frames are also looked up in and added to
+    it, so frames resized by earlier runs aren't resized again.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.store_dir = None
+        self._hashes = {}
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def hash_files(self, paths):
+        """Returns the content hashes of files, hashing them in parallel"""
+        def cached_hash(path):
+            stat = os.stat(path)
+            key = (path, stat.st_size, stat.st_mtime_ns)
+            with self._lock:
+                if key in self._hashes:
+                    return self._hashes[key]
+            digest = hash_file(path)
+            with self._lock:
+                self._hashes[key] = digest
+            return digest
+
+        with ThreadPoolExecutor(max_workers=HASH_THREADS) as executor:
+            return list(executor.map(cached_hash, paths))
+
+    def fingerprint(self, seq_dir, settings):
+        """Returns a hash of a sequence's frame contents and of the
+        settings that affect its output, or None if it has no frames."""
+        if is_video(seq_dir):
+            hashes = self.hash_files([seq_dir])
+        else:
+            files = APNGProcessorHeadless(seq_dir, settings)._get_image_files()
+            if not files:
+                return None
+            hashes = self.hash_files(
+                [os.path.join(seq_dir, filename) for filename in files]
+            )
+
+        digest = hashlib.sha1(settings_hash(settings).encode("utf-8"))
+        for frame_hash in hashes:
+            digest.update(frame_hash.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the stored resized frame for a key, or None"""
+        with self._lock:
+            if key in self._frames:
+                return self._frames[key]
+        if not self.cache:
+            return None
+
+        cached = self.cache.get_file(RESIZED, get_cache_key(*key))
+        if cached:
+            with self._lock:
+                self._frames.setdefault(key, cached)
+        return cached
+
+    def add(self, key, path):
+        """Stores a resized frame and returns its path in the store"""
+        with self._lock:
+            if key in self._frames:
+                return self._frames[key]
+            if not self.store_dir:
+                self.store_dir = make_temp_dir("frames")
+            stored = os.path.join(self.store_dir, f"{len(self._frames)}.png")
+            link_or_copy(path, stored)
+            self._frames[key] = stored
+        if self.cache:
+            self.cache.add_file(RESIZED, get_cache_key(*key), stored)
+        return stored
+
+    def cleanup(self):
+        if self.store_dir:
+            shutil.rmtree(self.store_dir, ignore_errors=True)
+            self.store_dir = None
+        self._frames = {}
+
+
+def group_duplicates(seq_dirs, settings, shared):
+    """Groups folders whose frames and settings are identical.
+
+    Returns:
+        groups (lst): lists of folders in input order, the first folder of
+            each group is the one to process.
+    """
+    groups = {}
+    for seq_dir in seq_dirs:
+        try:
+            fingerprint = shared.fingerprint(seq_dir, settings)
+        except OSError as e:
+            LOGGER.warning(f"Could not fingerprint {seq_dir}: {e}")
+            fingerprint = None
+        # Unreadable folders are processed on their own to report errors
+        groups.setdefault(fingerprint or seq_dir, []).append(seq_dir)
+
+    for group in groups.values():
+        if len(group) > 1:
+            LOGGER.info(
+                f"{group[0]} has {len(group) - 1} duplicate(s): "
+                + ", ".join(group[1:])
+            )
+    return list(groups.values())
@@ -0,0 +1,52 @@
+import numpy as np
+
+
+class TemporalDenoise:
+    """Frame stage that holds pixels which barely change between frames.
+
+    A pixel is copied from the previous (already denoised) frame when none
+    of its channels differ by more than `threshold`, and fully transparent
+    pixels are kept transparent the same way. The noise and dithering of
+    rendered sequences then no longer changes every pixel of every frame,
+    so the delta encoding of the APNG can skip the unchanged areas.
+
+    Small thresholds (2-4) aren't visible but already make static areas
+    identical. The error is bounded by the threshold, slow changes are
+    held until they exceed it.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = int(threshold)
+        self._previous = None
+        self._diff = None
+        self._close = None
+        self._hold = None
+        self._transparent = None
+        self._previous_transparent = None
+
+    def __call__(self, frame):
+        if self._previous is None:
+            # Buffers are allocated once and reused for all frames
+            self._previous = frame.copy()
+            self._diff = np.empty(frame.shape, dtype=np.int16)
+            self._close = np.empty(frame.shape, dtype=bool)
+            self._hold = np.empty(frame.shape[:2], dtype=bool)
+            self._transparent = np.empty(frame.shape[:2], dtype=bool)
+            self._previous_transparent = np.empty(frame.shape[:2], dtype=bool)
+            return
+
+        np.subtract(frame, self._previous, out=self._diff, dtype=np.int16)
+        np.abs(self._diff, out=self._diff)
+        np.less_equal(self._diff, self.threshold, out=self._close)
+        np.logical_and.reduce(self._close, axis=2, out=self._hold)
+        if frame.shape[2] == 4:
+            np.equal(frame[..., 3], 0, out=self._transparent)
+            np.equal(self._previous[..., 3], 0, out=self._previous_transparent)
+            np.logical_and(
+                self._transparent, self._previous_transparent,
+                out=self._transparent,
+            )
+            np.logical_or(self._hold, self._transparent, out=self._hold)
+
+        np.copyto(frame, self._previous, where=self._hold[..., None])
+        np.copyto(self._previous, frame)
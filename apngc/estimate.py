@@ -0,0 +1,387 @@
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+from .apng import (
+    APNGProcessorHeadless,
+    get_ffmpeg_exe,
+    get_image_size,
+    get_resampled_frames,
+    get_video_info,
+    is_video,
+    make_temp_dir,
+)
+from .dedup import SharedFrames, group_duplicates, link_or_copy
+from .journal import inputs_hash, settings_hash
+from .settings import get_local_settings_path
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+SAMPLE_FRAMES = 6
+SMOOTHING = 0.5  # weight of the latest run in the calibration factors
+MAX_PENDING = 1000  # estimates remembered until their folder is run
+
+# Conversions running side by side calibrate the same file
+_calibration_lock = threading.Lock()
+
+
+def get_calibration_path():
+    """Returns the file calibration factors are kept in"""
+    return os.path.join(
+        os.path.dirname(get_local_settings_path()), "calibration.json"
+    )
+
+
+class Calibration:
+    """Correction factors learnt by comparing estimates with real runs.
+
+    Estimates are remembered per folder and settings. When a folder is
+    then converted with the same settings, the ratio of real to estimated
+    bytes and seconds updates the factors of those settings, which correct
+    all later estimates. This also learns effects the samples can't show,
+    like the savings of tinify.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_calibration_path()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"factors": {}, "pending": {}}
+
+    def _save(self, data):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{uuid.uuid4().hex}"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(temp_path, self.path)
+
+    def get_factors(self, settings):
+        """Returns the bytes and seconds factors and the number of runs
+        they are based on, for the given settings."""
+        factors = self._load()["factors"].get(settings_hash(settings))
+        return factors or {"bytes": 1.0, "seconds": 1.0, "runs": 0}
+
+    def add_estimate(self, seq_dir, settings, out_bytes, seconds):
+        """Remembers an uncorrected estimate until the folder is run"""
+        key = f"{inputs_hash(seq_dir)}:{settings_hash(settings)}"
+        with _calibration_lock:
+            data = self._load()
+            pending = data["pending"]
+            pending.pop(key, None)
+            pending[key] = {"bytes": out_bytes, "seconds": seconds}
+            # Forget the oldest estimates that were never run
+            for old_key in list(pending)[:-MAX_PENDING]:
+                del pending[old_key]
+            self._save(data)
+
+    def add_run(self, seq_dir, settings, out_bytes, seconds):
+        """Updates the factors if the folder was estimated before"""
+        key = f"{inputs_hash(seq_dir)}:{settings_hash(settings)}"
+        with _calibration_lock:
+            data = self._load()
+            estimate = data["pending"].pop(key, None)
+            if not estimate:
+                return
+
+            factors = data["factors"].setdefault(
+                settings_hash(settings),
+                {"bytes": 1.0, "seconds": 1.0, "runs": 0},
+            )
+            weight = 1.0 if not factors["runs"] else SMOOTHING
+            for name, real in (("bytes", out_bytes), ("seconds", seconds)):
+                if estimate[name]:
+                    ratio = real / estimate[name]
+                    factors[name] += weight * (ratio - factors[name])
+            factors["runs"] += 1
+            self._save(data)
+        LOGGER.info(f"Calibrated estimates with the run of {seq_dir}")
+
+
+def record_run(seq_dir, settings, out_filename, seconds):
+    """Calibrates estimates with a finished conversion, never raises"""
+    try:
+        Calibration().add_run(
+            seq_dir, settings, os.path.getsize(out_filename), seconds
+        )
+    except (OSError, ValueError, KeyError) as e:
+        LOGGER.warning(f"Could not calibrate with {seq_dir}: {e}")
+
+
+def _sample_sequence(seq_dir, settings, sample_dir, samples):
+    """Links a run of consecutive frames from the middle of a sequence
+    into `sample_dir`, so the sample changes from frame to frame like the
+    full sequence does.
+
+    Returns:
+        frames (int): the number of frames of the full sequence.
+        source_size (tuple): the width and height of the frames.
+    """
+    files = APNGProcessorHeadless(seq_dir, settings)._get_image_files()
+    if len(files) < 2:
+        raise ValueError(f"Found {len(files)} frame(s) in {seq_dir}")
+
+    start = max(0, (len(files) - samples) // 2)
+    for index, filename in enumerate(files[start:start + samples]):
+        ext = filename.rsplit(".", 1)[-1]
+        link_or_copy(
+            os.path.join(seq_dir, filename),
+            os.path.join(sample_dir, f"sample.{index + 1:04d}.{ext}"),
+        )
+    frames = len(get_resampled_frames(
+        len(files), settings.get("source_framerate"), settings.get("framerate")
+    ))
+    return frames, get_image_size(os.path.join(seq_dir, files[0]))
+
+
+def _sample_video(video, settings, sample_dir, samples):
+    """Extracts a run of consecutive frames from the middle of the frame
+    range of a video. See `_sample_sequence`."""
+    info = get_video_info(video)
+    if not info:
+        raise ValueError(f"Could not probe {video}")
+
+    frames = info["frames"]
+    frame_start = settings.get("frame_start") or 0
+    frame_end = settings.get("frame_end")
+    if frame_end is None:
+        frame_end = frames - 1
+    frames = min(frames, frame_end - frame_start + 1)
+    start = frame_start + max(0, (frames - samples) // 2)
+    source_framerate = settings.get("source_framerate") or info["fps"]
+    if settings.get("framerate") and source_framerate:
+        frames = round(frames * settings["framerate"] / source_framerate)
+    frames = max(frames, 2)
+
+    ffmpeg_cmd = [
+        get_ffmpeg_exe(), "-v", "error", "-y",
+        "-ss", str(start / info["fps"]), "-i", video,
+        "-frames:v", str(samples), "-pix_fmt", "rgba",
+        os.path.join(sample_dir, "sample.%04d.png"),
+    ]
+    LOGGER.debug(
+        f"FFMPEG Sample Command: {subprocess.list2cmdline(ffmpeg_cmd)}"
+    )
+    subprocess.call(ffmpeg_cmd)
+    return frames, (info["width"], info["height"])
+
+
+def _convert_sample(sample_dir, settings, count=None):
+    """Converts the first `count` frames of a sample, all by default.
+
+    Returns:
+        frames (int): the number of frames converted.
+        bytes (int): the size of the output.
+        seconds (float): the time the conversion took.
+    """
+    out_dir = make_temp_dir("estimate_out")
+    try:
+        sample_settings = dict(settings)
+        sample_settings.update({
+            "output_path": out_dir,
+            "optimize": 0,
+            "frame_start": None,
+            "frame_end": None,
+            "source_framerate": None,
+        })
+        if count:
+            sample_settings["frame_end"] = count
+        processor = APNGProcessorHeadless(sample_dir, sample_settings)
+        start = time.monotonic()
+        processor.process()
+        seconds = time.monotonic() - start
+        return (
+            len(processor.files),
+            os.path.getsize(processor.out_filename),
+            seconds,
+        )
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def _extrapolate(small, large, frames):
+    """Returns `frames` worth of a cost measured for two sample sizes.
+
+    The cost is split into a fixed part, like starting ffmpeg or the PNG
+    headers, and a part per frame, so the fixed part isn't multiplied.
+
+    Args:
+        small (tuple): the frames and cost of the smaller sample.
+        large (tuple): the frames and cost of the larger sample.
+        frames (int): the number of frames to extrapolate to.
+    """
+    small_frames, small_cost = small
+    large_frames, large_cost = large
+    if large_frames <= small_frames:
+        return large_cost * frames / large_frames
+    per_frame = max(
+        (large_cost - small_cost) / (large_frames - small_frames), 0
+    )
+    fixed = max(large_cost - per_frame * large_frames, 0)
+    return fixed + per_frame * frames
+
+
+def estimate_sequence(seq_dir, settings, calibration=None,
+                      samples=SAMPLE_FRAMES):
+    """Estimates the output size and processing time of a folder.
+
+    A run of consecutive frames from the middle of the sequence is
+    converted for real, with the same settings except tinify, once with
+    `samples` frames and once with twice as many. The difference between
+    both gives the cost per frame and the rest the fixed cost, which are
+    extrapolated to all frames and corrected with the calibration factors
+    of the settings.
+
+    Args:
+        seq_dir (str): the folder (or video file) to estimate.
+        settings (dict): the settings it will be converted with.
+        calibration (Calibration): the calibration to use and remember
+            the estimate in, defaults to the local calibration.
+        samples (int): the number of frames of the smaller sample.
+    Returns:
+        estimate (dict): the estimated `bytes` and `seconds` with the
+            `frames`, `sample_frames` and `source_size` they are based on
+            and whether they were `calibrated`.
+    """
+    calibration = calibration or Calibration()
+    sample_dir = make_temp_dir("estimate")
+    try:
+        if is_video(seq_dir):
+            frames, source_size = _sample_video(
+                seq_dir, settings, sample_dir, samples * 2
+            )
+        else:
+            frames, source_size = _sample_sequence(
+                seq_dir, settings, sample_dir, samples * 2
+            )
+
+        large = _convert_sample(sample_dir, settings)
+        small_count = min(samples, large[0] // 2)
+        if small_count >= 2:
+            small = _convert_sample(sample_dir, settings, small_count)
+        else:
+            small = large
+    finally:
+        shutil.rmtree(sample_dir, ignore_errors=True)
+
+    small_frames, small_bytes, small_seconds = small
+    sample_frames, large_bytes, large_seconds = large
+    out_bytes = round(_extrapolate(
+        (small_frames, small_bytes), (sample_frames, large_bytes), frames
+    ))
+    seconds = _extrapolate(
+        (small_frames, small_seconds), (sample_frames, large_seconds), frames
+    )
+    calibration.add_estimate(seq_dir, settings, out_bytes, seconds)
+
+    factors = calibration.get_factors(settings)
+    return {
+        "folder": seq_dir,
+        "frames": frames,
+        "sample_frames": sample_frames,
+        "source_size": source_size,
+        "bytes": round(out_bytes * factors["bytes"]),
+        "seconds": seconds * factors["seconds"],
+        "calibrated": factors["runs"] > 0,
+    }
+
+
+def estimate_batch(seq_dirs, settings, budget=None, samples=SAMPLE_FRAMES,
+                   dedup=True):
+    """Estimates the outputs of a batch and its total wall time.
+
+    Jobs are assumed to share the budget's threads as they do when the
+    batch is run, but a batch never takes less time than its longest job.
+    With `dedup`, folders with identical frames are estimated and counted
+    once, as `run_batch` only converts them once.
+
+    Returns:
+        estimate (dict): the `jobs` estimates, their `error`, or the
+            folder they are a `duplicate_of`, with the total `bytes` and
+            wall time `seconds`.
+    """
+    if dedup:
+        shared = SharedFrames()
+        try:
+            groups = group_duplicates(seq_dirs, settings, shared)
+        finally:
+            shared.cleanup()
+    else:
+        groups = [[seq_dir] for seq_dir in seq_dirs]
+
+    calibration = Calibration()
+    jobs = []
+    thread_seconds = 0
+    for seq_dir, *duplicates in groups:
+        try:
+            job = estimate_sequence(
+                seq_dir, settings, calibration=calibration, samples=samples
+            )
+        except Exception as e:
+            LOGGER.error(f"Could not estimate {seq_dir}: {e}")
+            job = {"folder": seq_dir, "error": str(e)}
+        jobs.append(job)
+        jobs.extend(
+            {"folder": duplicate, "duplicate_of": seq_dir}
+            for duplicate in duplicates
+        )
+        if "error" in job:
+            continue
+
+        threads = 1
+        if budget and job["source_size"]:
+            size = (settings.get("width"), settings.get("height"))
+            threads = budget.fit(job["source_size"], size, job["frames"])[0]
+        thread_seconds += job["seconds"] * threads
+
+    estimated = [job for job in jobs if "bytes" in job]
+    threads = budget.threads if budget else 1
+    return {
+        "jobs": jobs,
+        "bytes": sum(job["bytes"] for job in estimated),
+        "seconds": max(
+            [thread_seconds / threads]
+            + [job["seconds"] for job in estimated]
+        ),
+    }
+
+
+def format_duration(seconds):
+    """Returns seconds as hours, minutes and seconds, like `1h02m05s`"""
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s"
+
+
+def format_estimate(estimate):
+    """Returns a short human readable summary of a batch estimate"""
+    lines = []
+    for job in estimate["jobs"]:
+        if "error" in job:
+            lines.append(f"{job['folder']}: {job['error']}")
+            continue
+        if "duplicate_of" in job:
+            lines.append(
+                f"{job['folder']}: duplicate of {job['duplicate_of']}"
+            )
+            continue
+        calibrated = "" if job["calibrated"] else ", uncalibrated"
+        lines.append(
+            f"{job['folder']}: {job['frames']} frames, "
+            f"~{job['bytes'] / 1024:.0f} KB, ~{job['seconds']:.1f}s "
+            f"({job['sample_frames']} frames sampled{calibrated})"
+        )
+    lines.append(
+        f"Total: ~{estimate['bytes'] / 1024 ** 2:.1f} MB, "
+        f"~{format_duration(estimate['seconds'])}"
+    )
+    return "\n".join(lines)
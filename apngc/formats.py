@@ -0,0 +1,120 @@
+import logging
+import re
+import subprocess
+
+from .apng import get_ffmpeg_exe
+from .constants import OUTPUT_FORMATS
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+APNG, WEBP, GIF = OUTPUT_FORMATS
+EXTENSIONS = {APNG: ".png", WEBP: ".webp", GIF: ".gif"}
+
+# Encoded without any loss, so their quality doesn't need measuring
+LOSSLESS = [WEBP]
+
+
+def _get_hold_filters(framerate, hold):
+    """Returns the filters showing the last frame `hold` ms longer"""
+    if not hold or not framerate:
+        return []
+    return [f"tpad=stop_mode=clone:stop_duration={hold / 1000}"]
+
+
+def encode_webp(input_args, out, framerate, loops, hold=None):
+    """Encodes a sequence into a lossless animated WebP.
+
+    Args:
+        input_args (lst): the ffmpeg input arguments of the sequence.
+        out (str): the path of the WebP to write.
+        framerate (int): the frame rate of the animation.
+        loops (int): the number of plays, 0 plays forever.
+        hold (int): optional extra ms to show the last frame.
+    """
+    filters = _get_hold_filters(framerate, hold)
+    ffmpeg_cmd = [
+        get_ffmpeg_exe(), "-v", "error", "-y",
+        "-framerate", str(framerate), *input_args,
+        *(["-vf", ",".join(filters)] if filters else []),
+        "-c:v", "libwebp_anim", "-lossless", "1",
+        "-compression_level", "6", "-pix_fmt", "bgra",
+        "-loop", str(loops or 0), out,
+    ]
+    LOGGER.debug(
+        f"FFMPEG WebP Command: {subprocess.list2cmdline(ffmpeg_cmd)}"
+    )
+    subprocess.call(ffmpeg_cmd)
+
+
+def encode_gif(input_args, out, framerate, loops, hold=None):
+    """Encodes a sequence into an animated GIF with an optimized palette.
+
+    GIFs hold 256 colors and on/off transparency, so they are lossy for
+    most sequences. See `encode_webp` for the arguments.
+    """
+    filters = _get_hold_filters(framerate, hold) + ["split[a][b]"]
+    graph = ";".join([
+        ",".join(filters),
+        "[a]palettegen=reserve_transparent=1:stats_mode=full[palette]",
+        "[b][palette]paletteuse=dither=sierra2_4a",
+    ])
+    # GIF counts the repeats after the first play, -1 plays once
+    if not loops:
+        repeats = 0
+    elif loops == 1:
+        repeats = -1
+    else:
+        repeats = loops - 1
+    ffmpeg_cmd = [
+        get_ffmpeg_exe(), "-v", "error", "-y",
+        "-framerate", str(framerate), *input_args,
+        "-filter_complex", graph,
+        "-loop", str(repeats),
+        out,
+    ]
+    LOGGER.debug(
+        f"FFMPEG GIF Command: {subprocess.list2cmdline(ffmpeg_cmd)}"
+    )
+    subprocess.call(ffmpeg_cmd)
+
+
+ENCODERS = {WEBP: encode_webp, GIF: encode_gif}
+
+
+def get_ssim(path, input_args, framerate):
+    """Returns the SSIM (0-1) of an encoded animation against its source
+    frames, or None if ffmpeg can't compare them.
+
+    Colors are compared premultiplied by alpha, so invisible colors under
+    transparent pixels don't count, and alpha is compared on its own. The
+    lower of both scores is returned. Both inputs are retimed to frame
+    numbers at `framerate`, so frames are paired by index even when the
+    containers use different timebases.
+    """
+    graph = []
+    for index, name in enumerate("ab"):
+        graph.extend([
+            f"[{index}:v]settb=AVTB,setpts=N/({framerate}*TB),"
+            f"format=rgba,split[{name}][{name}_alpha]",
+            f"[{name}]premultiply=inplace=1,format=rgb24[{name}_rgb]",
+            f"[{name}_alpha]alphaextract[{name}_a]",
+        ])
+    graph.extend(["[a_rgb][b_rgb]ssim", "[a_a][b_a]ssim"])
+    ffmpeg_cmd = [
+        get_ffmpeg_exe(), "-v", "info", "-nostats", "-i", path,
+        "-framerate", str(framerate), *input_args,
+        "-lavfi", ";".join(graph),
+        "-f", "null", "-",
+    ]
+    LOGGER.debug(
+        f"FFMPEG SSIM Command: {subprocess.list2cmdline(ffmpeg_cmd)}"
+    )
+    result = subprocess.run(
+        ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        text=True, errors="replace",
+    )
+    scores = re.findall(r"All:([0-9.]+)", result.stderr)
+    if len(scores) != 2:
+        return None
+    return min(float(score) for score in scores)
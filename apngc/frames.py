@@ -0,0 +1,254 @@
+import logging
+import queue
+import subprocess
+import threading
+
+import numpy as np
+
+from .apng import get_ffmpeg_exe
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+CHANNELS = {"rgba": 4, "rgb24": 3, "gray": 1}
+
+# Frames held in memory at once by a pipeline, over all its stages
+MAX_IN_FLIGHT = 8
+
+
+class FrameRing:
+    """A fixed set of preallocated frame buffers that are reused.
+
+    `acquire` blocks while all buffers are in use, which is what bounds
+    the memory of a pipeline and slows down its source when the later
+    stages can't keep up.
+    """
+
+    def __init__(self, shape, count=MAX_IN_FLIGHT):
+        self.shape = shape
+        self.count = count
+        self._free = queue.Queue()
+        for _index in range(count):
+            self._free.put(np.empty(shape, dtype=np.uint8))
+
+    def acquire(self, abort=None):
+        """Returns a free buffer, or None when `abort` got set"""
+        while True:
+            try:
+                return self._free.get(timeout=0.1)
+            except queue.Empty:
+                if abort is not None and abort.is_set():
+                    return None
+
+    def release(self, frame):
+        self._free.put(frame)
+
+
+def _get_reader_cmd(input_args, filters, pix_fmt):
+    ffmpeg_cmd = [get_ffmpeg_exe(), "-v", "error"] + list(input_args)
+    if filters:
+        ffmpeg_cmd += ["-vf", ",".join(filters)]
+    ffmpeg_cmd += ["-f", "rawvideo", "-pix_fmt", pix_fmt, "-"]
+    LOGGER.debug(
+        f"FFMPEG Reading Command: {subprocess.list2cmdline(ffmpeg_cmd)}"
+    )
+    return ffmpeg_cmd
+
+
+def _read_into(stream, frame):
+    """Fills a frame buffer from a stream, returns False at the end"""
+    view = memoryview(frame).cast("B")
+    filled = 0
+    while filled < len(view):
+        read = stream.readinto(view[filled:])
+        if not read:
+            return False
+        filled += read
+    return True
+
+
+def iter_raw_frames(input_args, width, height, filters=None,
+                    pix_fmt="rgba"):
+    """Streams decoded frames from ffmpeg as NumPy arrays.
+
+    Frames are piped as raw video, nothing is written to disk. All frames
+    are read into the same preallocated buffer, so a frame is only valid
+    until the next one is requested; copy it to keep it.
+
+    Args:
+        input_args (lst): the ffmpeg input arguments.
+        width (int): the width of the frames after the filters.
+        height (int): the height of the frames after the filters.
+        filters (lst): optional ffmpeg video filters to apply.
+        pix_fmt (str): the pixel format of the frames, see CHANNELS.
+    Yields:
+        frame (np.ndarray): an array of shape (height, width, channels).
+    """
+    frame = np.empty((height, width, CHANNELS[pix_fmt]), dtype=np.uint8)
+    process = subprocess.Popen(
+        _get_reader_cmd(input_args, filters, pix_fmt), stdout=subprocess.PIPE
+    )
+    try:
+        while _read_into(process.stdout, frame):
+            yield frame
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+class FramePipeline:
+    """Runs frames through in-memory stages between ffmpeg pipes.
+
+    Frames are decoded by ffmpeg into the buffers of a FrameRing, passed
+    through each stage in its own thread over bounded queues, and encoded
+    by a second ffmpeg into a PNG sequence. No stage allocates frames, and
+    at most `max_in_flight` frames exist at any time however long the
+    sequence is.
+
+    A stage is a callable that modifies the RGBA frame array it is given
+    in place. Stages see frames in order, so they may keep state between
+    frames (e.g. a copy of the previous frame).
+
+    `threads` limits the threads of both ffmpeg processes, by default
+    ffmpeg decides.
+    """
+
+    def __init__(self, stages, max_in_flight=None, threads=None):
+        self.stages = list(stages)
+        self.max_in_flight = max_in_flight or MAX_IN_FLIGHT
+        self.threads = threads
+        self._abort = threading.Event()
+        self._errors = []
+
+    def run(self, input_args, width, height, out, filters=None):
+        """Processes all frames of the input into the sequence `out`.
+
+        Args:
+            input_args (lst): the ffmpeg input arguments.
+            width (int): the width of the frames after the filters.
+            height (int): the height of the frames after the filters.
+            out (str): the output PNG sequence, e.g. `name_%04d.png`.
+            filters (lst): optional ffmpeg video filters to apply.
+        Returns:
+            frames (int): the number of frames written.
+        """
+        ring = FrameRing((height, width, 4), self.max_in_flight)
+        queues = [
+            queue.Queue(maxsize=self.max_in_flight)
+            for _index in range(len(self.stages) + 1)
+        ]
+
+        threads_args = ["-threads", str(self.threads)] if self.threads else []
+        reader = subprocess.Popen(
+            _get_reader_cmd(threads_args + list(input_args), filters, "rgba"),
+            stdout=subprocess.PIPE,
+        )
+        writer_cmd = [
+            get_ffmpeg_exe(), "-v", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{width}x{height}",
+            "-i", "-", *threads_args, "-start_number", "1", out,
+        ]
+        LOGGER.debug(
+            f"FFMPEG Writing Command: {subprocess.list2cmdline(writer_cmd)}"
+        )
+        writer = subprocess.Popen(writer_cmd, stdin=subprocess.PIPE)
+
+        threads = [
+            threading.Thread(
+                target=self._read, args=(reader, ring, queues[0]),
+                daemon=True,
+            )
+        ]
+        for index, stage in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=self._stage,
+                args=(stage, queues[index], queues[index + 1]),
+                daemon=True,
+            ))
+        for thread in threads:
+            thread.start()
+
+        frames = 0
+        try:
+            frames = self._write(writer, ring, queues[-1])
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._abort.set()
+            for process in (reader, writer):
+                if process.poll() is None and self._errors:
+                    process.kill()
+            reader.stdout.close()
+            if not writer.stdin.closed:
+                writer.stdin.close()
+            reader.wait()
+            writer.wait()
+            for thread in threads:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+        if writer.returncode:
+            raise RuntimeError(f"FFMPEG failed writing {out}")
+        return frames
+
+    def _fail(self, error):
+        self._errors.append(error)
+        self._abort.set()
+
+    def _put(self, frame_queue, frame):
+        while not self._abort.is_set():
+            try:
+                frame_queue.put(frame, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, frame_queue):
+        while True:
+            try:
+                return frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._abort.is_set():
+                    return None
+
+    def _read(self, reader, ring, out_queue):
+        try:
+            while True:
+                frame = ring.acquire(self._abort)
+                if frame is None:
+                    return
+                if not _read_into(reader.stdout, frame):
+                    break
+                if not self._put(out_queue, frame):
+                    return
+        except Exception as e:
+            self._fail(e)
+        # Sentinel, no more frames
+        self._put(out_queue, None)
+
+    def _stage(self, stage, in_queue, out_queue):
+        try:
+            while True:
+                frame = self._get(in_queue)
+                if frame is None:
+                    break
+                stage(frame)
+                if not self._put(out_queue, frame):
+                    return
+        except Exception as e:
+            self._fail(e)
+        self._put(out_queue, None)
+
+    def _write(self, writer, ring, in_queue):
+        frames = 0
+        while True:
+            frame = self._get(in_queue)
+            if frame is None:
+                break
+            writer.stdin.write(memoryview(frame).cast("B"))
+            ring.release(frame)
+            frames += 1
+        writer.stdin.close()
+        return frames
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+JOURNAL_NAME = ".apngc-journal.jsonl"
+
+STARTED = "started"
+DONE = "done"
+FAILED = "failed"
+
+# Settings that don't change the resulting file
+UNHASHED_SETTINGS = ("tinify_key", "output_path")
+
+
+def get_journal_path(output_path):
+    """Returns the default journal path for an output directory"""
+    return os.path.join(output_path, JOURNAL_NAME)
+
+
+def settings_hash(settings):
+    """Returns a hash of all settings that affect the output"""
+    relevant = {
+        key: value
+        for key, value in settings.items()
+        if key not in UNHASHED_SETTINGS
+    }
+    data = json.dumps(relevant, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+def inputs_hash(seq_dir):
+    """Returns a hash of the names, sizes and modification times of a
+    folder's files (or of a video file), so that changed inputs are
+    detected without reading all frames."""
+    digest = hashlib.sha1()
+    if os.path.isfile(seq_dir):
+        stat = os.stat(seq_dir)
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    elif os.path.isdir(seq_dir):
+        for filename in sorted(os.listdir(seq_dir)):
+            stat = os.stat(os.path.join(seq_dir, filename))
+            digest.update(f"{filename}:{stat.st_size}:{stat.st_mtime_ns};"
+                          .encode("utf-8"))
+    return digest.hexdigest()
+
+
+class Journal:
+    """Append-only record of the jobs of a batch.
+
+    Every state change of a job is appended as a JSON line and flushed to
+    disk immediately, so the journal survives the process being killed.
+    The last entry of a job is its current state.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, seq_dir, settings, status, **fields):
+        entry = {
+            "time": time.time(),
+            "folder": os.path.abspath(seq_dir),
+            "inputs_hash": inputs_hash(seq_dir),
+            "settings_hash": settings_hash(settings),
+            "status": status,
+        }
+        entry.update(fields)
+
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def entries(self):
+        """Returns the last recorded entry per folder"""
+        entries = {}
+        if not os.path.isfile(self.path):
+            return entries
+
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line may be incomplete after a crash
+                    continue
+                entries[entry["folder"]] = entry
+        return entries
+
+    def is_complete(self, seq_dir, settings, entries=None):
+        """Returns whether a folder was already converted with the same
+        inputs and settings and its output still exists.
+
+        Pass the `entries` of the journal when checking many folders, so
+        it's only read once.
+        """
+        if entries is None:
+            entries = self.entries()
+        entry = entries.get(os.path.abspath(seq_dir))
+        if not entry or entry["status"] != DONE:
+            return False
+
+        return (
+            entry["inputs_hash"] == inputs_hash(seq_dir)
+            and entry["settings_hash"] == settings_hash(settings)
+            and os.path.isfile(entry.get("output", ""))
+        )
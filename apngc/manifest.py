@@ -0,0 +1,241 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from .apng import APNGProcessorHeadless
+from .settings import PresetCache, validate_settings
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 10  # seconds between lock touches
+STALE_AFTER = 60  # seconds without heartbeat before a claim is re-queued
+
+
+def load_manifest(manifest_path):
+    """Reads the jobs from a JSONL manifest.
+
+    Each line is a JSON object with a `folder` (or video file), `settings`
+    (a preset name or settings file) and optional `output_path`, `tinify`,
+    `frame_start`, `frame_end` and `source_framerate` keys.
+    Relative paths are resolved against the manifest's directory.
+
+    Args:
+        manifest_path (str): the path to the manifest.
+    Returns:
+        jobs (lst): a list of job dictionaries, each with a stable `id`.
+    """
+    root = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(path):
+        return os.path.normpath(os.path.join(root, path))
+
+    jobs = []
+    with open(manifest_path, "r") as f:
+        for index, line in enumerate(f):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            job = json.loads(line)
+            digest = hashlib.sha1(line.encode("utf-8")).hexdigest()[:8]
+            job["id"] = f"{index:06d}-{digest}"
+            job["folder"] = resolve(job["folder"])
+            if os.path.exists(resolve(job["settings"])):
+                job["settings"] = resolve(job["settings"])
+            if job.get("output_path"):
+                job["output_path"] = resolve(job["output_path"])
+            jobs.append(job)
+    return jobs
+
+
+class ManifestWorker:
+    """Processes the jobs of a manifest shared between render nodes.
+
+    Any number of workers, on any node that sees the same filesystem, can
+    run against the same manifest. Coordination happens through files in
+    the state directory next to the manifest:
+
+        claims/<id>.lock  created exclusively by the worker running a job
+                          and touched periodically as heartbeat
+        done/<id>         written when a job finished
+        failed/<id>       written when a job raised an error
+
+    Claims that have not seen a heartbeat for `stale_after` seconds belong
+    to a dead worker and are taken over by the next worker that sees them.
+    """
+
+    def __init__(self, manifest_path, worker_id=None, state_dir=None,
+                 tinify=None, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 stale_after=STALE_AFTER):
+        self.manifest_path = manifest_path
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.state_dir = state_dir or os.path.abspath(manifest_path) + ".state"
+        self.tinify = tinify
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.presets = PresetCache()
+
+        for name in ("claims", "done", "failed"):
+            os.makedirs(os.path.join(self.state_dir, name), exist_ok=True)
+
+    def run(self, poll_interval=5):
+        """Processes claimable jobs until every job is done or failed.
+
+        Returns:
+            failed (int): the number of jobs that failed.
+        """
+        jobs = load_manifest(self.manifest_path)
+        LOGGER.info(
+            f"Worker {self.worker_id} processing {len(jobs)} jobs "
+            f"from {self.manifest_path}"
+        )
+        while True:
+            pending = [job for job in jobs if not self._is_finished(job)]
+            if not pending:
+                break
+
+            claimed = False
+            for job in pending:
+                if self._claim(job):
+                    claimed = True
+                    self._run_job(job)
+
+            if not claimed:
+                # Remaining jobs are claimed by other live workers, keep
+                # watching in case one of them dies
+                time.sleep(poll_interval)
+
+        failed = len(os.listdir(os.path.join(self.state_dir, "failed")))
+        LOGGER.info(f"Manifest finished, {failed} failed job(s)")
+        return failed
+
+    def _path(self, kind, job):
+        if kind == "claims":
+            return os.path.join(self.state_dir, kind, job["id"] + ".lock")
+        return os.path.join(self.state_dir, kind, job["id"])
+
+    def _is_finished(self, job):
+        return os.path.exists(self._path("done", job)) or os.path.exists(
+            self._path("failed", job)
+        )
+
+    def _claim(self, job):
+        """Atomically claims a job, taking over stale claims"""
+        lock = self._path("claims", job)
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._take_over_stale(lock):
+                return False
+            return self._claim(job)
+
+        with os.fdopen(fd, "w") as f:
+            f.write(self.worker_id)
+
+        # Another worker may have finished it between listing and claiming
+        if self._is_finished(job):
+            self._release(lock)
+            return False
+        return True
+
+    def _take_over_stale(self, lock):
+        """Removes a claim without recent heartbeat.
+
+        The lock is renamed to a name unique to this worker first, so only
+        one of several workers noticing the same stale claim wins.
+        """
+        try:
+            if time.time() - os.path.getmtime(lock) < self.stale_after:
+                return False
+            stale = f"{lock}.{self.worker_id}.stale"
+            os.rename(lock, stale)
+        except FileNotFoundError:
+            # Released or taken over by someone else meanwhile
+            return True
+
+        if time.time() - os.path.getmtime(stale) < self.stale_after:
+            # Lost a race and took a freshly created claim, put it back
+            try:
+                os.link(stale, lock)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+
+        with open(stale, "r") as f:
+            owner = f.read()
+        LOGGER.warning(f"Re-queuing job from dead worker {owner}: {lock}")
+        os.remove(stale)
+        return True
+
+    def _heartbeat(self, lock, stop):
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                with open(lock, "r") as f:
+                    owner = f.read()
+                if owner != self.worker_id:
+                    raise FileNotFoundError(lock)
+                os.utime(lock)
+            except FileNotFoundError:
+                LOGGER.warning(f"Lost claim {lock}, job may run twice")
+                return
+
+    def _run_job(self, job):
+        lock = self._path("claims", job)
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(lock, stop), daemon=True
+        )
+        heartbeat.start()
+
+        LOGGER.info(f"Worker {self.worker_id} running {job['id']}")
+        result = {"worker": self.worker_id, "folder": job["folder"]}
+        try:
+            settings = self.presets.get(job["settings"])
+            if self.tinify:
+                settings["tinify_key"] = self.tinify
+            if job.get("tinify"):
+                settings["tinify_key"] = job["tinify"]
+            if job.get("output_path"):
+                settings["output_path"] = job["output_path"]
+                os.makedirs(job["output_path"], exist_ok=True)
+            for key in ("frame_start", "frame_end", "source_framerate"):
+                if job.get(key) is not None:
+                    settings[key] = job[key]
+
+            errors = validate_settings(settings)
+            if errors:
+                raise ValueError(" ".join(errors))
+
+            APNGProcessorHeadless(job["folder"], settings).process()
+        except Exception as e:
+            LOGGER.error(f"Job {job['id']} failed: {e}")
+            result["error"] = str(e)
+            self._write_marker(self._path("failed", job), result)
+        else:
+            self._write_marker(self._path("done", job), result)
+        finally:
+            stop.set()
+            heartbeat.join()
+            self._release(lock)
+
+    def _release(self, lock):
+        try:
+            with open(lock, "r") as f:
+                if f.read() != self.worker_id:
+                    return
+            os.remove(lock)
+        except FileNotFoundError:
+            pass
+
+    def _write_marker(self, path, data):
+        data["time"] = time.time()
+        temp_path = f"{path}.{self.worker_id}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
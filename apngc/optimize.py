@@ -0,0 +1,346 @@
+import logging
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .cache import COMPRESSED, get_cache_key
+from .png import (
+    get_bits_per_pixel,
+    parse_fctl,
+    parse_ihdr,
+    read_chunks,
+    write_chunks,
+)
+
+try:
+    # Optional, much slower but denser deflate
+    import zopfli.zlib as zopfli_zlib
+except ImportError:
+    zopfli_zlib = None
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+NONE, SUB, UP, AVERAGE, PAETH = range(5)
+
+# zlib (strategy, memory level) combinations tried for every candidate
+ZLIB_SETTINGS = [
+    (zlib.Z_DEFAULT_STRATEGY, 9),
+    (zlib.Z_FILTERED, 9),
+    (zlib.Z_DEFAULT_STRATEGY, 8),
+]
+
+
+def _paeth_predictor(left, up, up_left):
+    """Vectorized Paeth predictor on int16 arrays"""
+    estimate = left + up - up_left
+    distance_left = np.abs(estimate - left)
+    distance_up = np.abs(estimate - up)
+    distance_up_left = np.abs(estimate - up_left)
+    return np.where(
+        (distance_left <= distance_up) & (distance_left <= distance_up_left),
+        left,
+        np.where(distance_up <= distance_up_left, up, up_left),
+    )
+
+
+def unfilter(data, height, row_bytes, bpp):
+    """Reverses the PNG scanline filters.
+
+    Args:
+        data (bytes): the decompressed image data, a filter type byte
+            followed by `row_bytes` bytes for every row.
+        height (int): the number of rows.
+        row_bytes (int): the number of bytes of a row.
+        bpp (int): the bytes per complete pixel, at least 1.
+    Returns:
+        raw (np.ndarray): uint8 array of shape (height, row_bytes).
+    """
+    rows = np.frombuffer(data, dtype=np.uint8).reshape(height, row_bytes + 1)
+    if np.isin(rows[:, 0], (AVERAGE, PAETH)).any():
+        return _unfilter_wavefront(rows, bpp)
+
+    raw = np.zeros((height, row_bytes), dtype=np.uint8)
+    previous = np.zeros(row_bytes, dtype=np.uint8)
+    for y in range(height):
+        filter_type = rows[y, 0]
+        row = rows[y, 1:]
+        if filter_type == NONE:
+            raw[y] = row
+        elif filter_type == SUB:
+            # Each byte adds the unfiltered byte bpp to its left, which is
+            # a running sum per interleaved channel
+            padded = np.zeros(-(-row_bytes // bpp) * bpp, dtype=np.uint8)
+            padded[:row_bytes] = row
+            lanes = np.cumsum(padded.reshape(-1, bpp), axis=0, dtype=np.uint8)
+            raw[y] = lanes.reshape(-1)[:row_bytes]
+        else:
+            raw[y] = row + previous
+        previous = raw[y]
+    return raw
+
+
+def _unfilter_wavefront(rows, bpp):
+    """Reverses the scanline filters of images using Average or Paeth.
+
+    These predict from the pixel just unfiltered to the left, so a row
+    can't be unfiltered at once. A pixel only depends on the pixels left,
+    up and up-left of it though, so all pixels of an anti-diagonal are
+    unfiltered together. The image is skewed so that every anti-diagonal
+    is a contiguous row, which takes width + height vectorized steps.
+    """
+    height, row_bytes = rows.shape[0], rows.shape[1] - 1
+    pixels = -(-row_bytes // bpp)
+    filtered = np.zeros((height, pixels * bpp), dtype=np.int16)
+    filtered[:, :row_bytes] = rows[:, 1:]
+    filtered = filtered.reshape(height, pixels, bpp)
+
+    # skewed[2 + x + y, 1 + y] holds pixel (x, y), with zeros around it
+    # for the pixels left of and above the image
+    ys, xs = np.indices((height, pixels))
+    diagonals = height + pixels - 1
+    skewed_filtered = np.zeros((diagonals, height, bpp), dtype=np.int16)
+    skewed_filtered[xs + ys, ys] = filtered
+    skewed = np.zeros((diagonals + 2, height + 1, bpp), dtype=np.int16)
+
+    # Rows of the other filter types are unfiltered along with them
+    types = rows[:, 0][:, None]
+    is_none, is_sub, is_up, is_average = (
+        types == filter_type for filter_type in (NONE, SUB, UP, AVERAGE)
+    )
+    for diagonal in range(diagonals):
+        # The rows crossed by this diagonal, and the same rows shifted
+        # into the padded skewed array
+        span = slice(max(0, diagonal - pixels + 1), min(height, diagonal + 1))
+        padded_span = slice(span.start + 1, span.stop + 1)
+        left = skewed[diagonal + 1, padded_span]
+        up = skewed[diagonal + 1, span]
+        up_left = skewed[diagonal, span]
+
+        predicted = _paeth_predictor(left, up, up_left)
+        np.copyto(predicted, left, where=is_sub[span])
+        np.copyto(predicted, up, where=is_up[span])
+        np.copyto(predicted, (left + up) >> 1, where=is_average[span])
+        np.copyto(predicted, 0, where=is_none[span])
+        predicted += skewed_filtered[diagonal, span]
+        predicted &= 0xFF
+        skewed[diagonal + 2, padded_span] = predicted
+
+    raw = skewed[xs + ys + 2, ys + 1].reshape(height, pixels * bpp)
+    return raw[:, :row_bytes].astype(np.uint8)
+
+
+def filter_all(raw, bpp):
+    """Returns the image filtered with each of the five filter types.
+
+    Returns:
+        filtered (np.ndarray): uint8 array of shape (5, height, row_bytes).
+    """
+    current = raw.astype(np.int16)
+    left = np.zeros_like(current)
+    left[:, bpp:] = current[:, :-bpp]
+    up = np.zeros_like(current)
+    up[1:] = current[:-1]
+    up_left = np.zeros_like(current)
+    up_left[1:, bpp:] = current[:-1, :-bpp]
+
+    predictions = [
+        np.zeros_like(current),
+        left,
+        up,
+        (left + up) >> 1,
+        _paeth_predictor(left, up, up_left),
+    ]
+    return np.stack(
+        [(current - prediction).astype(np.uint8) for prediction in predictions]
+    )
+
+
+def get_candidates(raw, bpp):
+    """Returns candidate filtered streams for an image.
+
+    One per filter type applied to every row, plus the adaptive choice of
+    the filter with the minimum sum of absolute differences per row.
+    """
+    filtered = filter_all(raw, bpp)
+    height = raw.shape[0]
+
+    candidates = []
+    for filter_type in range(5):
+        types = np.full(height, filter_type, dtype=np.uint8)
+        candidates.append(_join_rows(types, filtered[filter_type]))
+
+    # Score bytes as signed differences, small magnitudes compress best
+    scores = np.abs(filtered.view(np.int8).astype(np.int16)).sum(axis=2)
+    types = scores.argmin(axis=0).astype(np.uint8)
+    adaptive = filtered[types, np.arange(height)]
+    candidates.append(_join_rows(types, adaptive))
+    return candidates
+
+
+def _join_rows(types, rows):
+    return np.concatenate([types[:, None], rows], axis=1).tobytes()
+
+
+def deflate(data, zopfli=True):
+    """Returns the smallest zlib stream found for the data"""
+    if zopfli and zopfli_zlib:
+        return zopfli_zlib.compress(data)
+
+    best = None
+    for strategy, mem_level in ZLIB_SETTINGS:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 15, mem_level,
+                                      strategy)
+        compressed = compressor.compress(data) + compressor.flush()
+        if best is None or len(compressed) < len(best):
+            best = compressed
+    return best
+
+
+def recompress_frame(args):
+    """Re-filters and re-deflates the image data of a single frame.
+
+    Args:
+        args (tuple): (compressed data, width, height, bits per pixel), as
+            a single tuple so it can be mapped over a process pool.
+    Returns:
+        data (bytes): the smallest zlib stream, never larger than the
+            original.
+    """
+    compressed, width, height, bits_per_pixel = args
+    row_bytes = -(-width * bits_per_pixel // 8)
+    bpp = max(1, bits_per_pixel // 8)
+
+    raw = unfilter(zlib.decompress(compressed), height, row_bytes, bpp)
+    candidates = get_candidates(raw, bpp)
+
+    # Find the best filtering with fast zlib, then spend the
+    # expensive compression only on the winner
+    best = min(candidates, key=lambda data: len(deflate(data, zopfli=False)))
+    recompressed = deflate(best)
+    if len(recompressed) < len(compressed):
+        return recompressed
+    return compressed
+
+
+def _split_frames(chunks, ihdr):
+    """Groups the image data chunks of a (A)PNG into frames.
+
+    Returns:
+        frames (lst): (first chunk index, chunk indices, compressed data,
+            width, height) per frame.
+    """
+    frames = []
+    width, height = ihdr["width"], ihdr["height"]
+    current = None
+    for index, (chunk_type, data) in enumerate(chunks):
+        if chunk_type == b"fcTL":
+            fctl = parse_fctl(data)
+            width, height = fctl["width"], fctl["height"]
+            current = None
+        elif chunk_type in (b"IDAT", b"fdAT"):
+            payload = data if chunk_type == b"IDAT" else data[4:]
+            if current is None or current["type"] != chunk_type:
+                current = {
+                    "type": chunk_type,
+                    "indices": [],
+                    "data": [],
+                    "width": width,
+                    "height": height,
+                }
+                frames.append(current)
+            current["indices"].append(index)
+            current["data"].append(payload)
+        else:
+            current = None
+    return frames
+
+
+def optimize_apng(path, processes=None, cache=None):
+    """Losslessly recompresses every frame of an (A)PNG in place.
+
+    Each frame's image data is unfiltered, re-filtered with every filter
+    strategy and re-deflated with the strongest compression available,
+    in parallel over a process pool. Frames only ever get smaller. The
+    file is rewritten with fresh sequence numbers and CRCs.
+
+    Args:
+        path (str): the path to the (A)PNG.
+        processes (int): the number of processes, defaults to the cores.
+        cache (FrameCache): optional cache of recompressed frame data,
+            frames found in it are spliced in without recompressing.
+    Returns:
+        saved (int): the number of bytes saved.
+    """
+    chunks = read_chunks(path)
+    ihdr = parse_ihdr(chunks[0][1])
+    if ihdr["interlace"]:
+        LOGGER.info(f"Skipping recompression of interlaced {path}")
+        return 0
+
+    frames = _split_frames(chunks, ihdr)
+    bits_per_pixel = get_bits_per_pixel(ihdr)
+    jobs = [
+        (b"".join(frame["data"]), frame["width"], frame["height"],
+         bits_per_pixel)
+        for frame in frames
+    ]
+    results = [None] * len(jobs)
+    keys = [None] * len(jobs)
+    if cache:
+        zopfli = bool(zopfli_zlib)
+        for index, job in enumerate(jobs):
+            keys[index] = get_cache_key(*job, zopfli)
+            results[index] = cache.get_data(COMPRESSED, keys[index])
+    missing = [index for index, data in enumerate(results) if data is None]
+
+    LOGGER.info(
+        f"Recompressing {len(missing)} of {len(jobs)} frame(s) of {path}"
+    )
+    missing_jobs = [jobs[index] for index in missing]
+    if processes == 1 or len(missing_jobs) <= 1:
+        recompressed = [recompress_frame(job) for job in missing_jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            recompressed = list(executor.map(recompress_frame, missing_jobs))
+    for index, data in zip(missing, recompressed):
+        results[index] = data
+        if cache:
+            cache.add_data(COMPRESSED, keys[index], data)
+
+    # Replace each frame's chunks by a single chunk with the new data
+    replaced = {}
+    dropped = set()
+    for frame, data in zip(frames, results):
+        first, *rest = frame["indices"]
+        if frame["type"] == b"fdAT":
+            # Sequence number is filled in below
+            data = struct.pack(">I", 0) + data
+        replaced[first] = (frame["type"], data)
+        dropped.update(rest)
+
+    output = []
+    sequence = 0
+    for index, chunk in enumerate(chunks):
+        if index in dropped:
+            continue
+        chunk_type, data = replaced.get(index, chunk)
+        if chunk_type in (b"fcTL", b"fdAT"):
+            data = struct.pack(">I", sequence) + data[4:]
+            sequence += 1
+        output.append((chunk_type, data))
+
+    before = os.path.getsize(path)
+    temp_path = path + ".recompress"
+    write_chunks(temp_path, output)
+    after = os.path.getsize(temp_path)
+    if after >= before:
+        os.remove(temp_path)
+        return 0
+
+    os.replace(temp_path, path)
+    LOGGER.info(f"Recompressed {path} from {before} to {after} bytes")
+    return before - after
@@ -0,0 +1,148 @@
+import os
+import struct
+import zlib
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Channels per color type
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+class PNGError(Exception):
+    pass
+
+
+def iter_chunks(f, verify_crc=False):
+    """Yields the (type, data) of every chunk of an opened PNG file.
+
+    Raises:
+        PNGError: if the file isn't a PNG, a chunk is truncated or, with
+            `verify_crc`, a chunk is corrupt.
+    """
+    if f.read(8) != PNG_SIGNATURE:
+        raise PNGError("Not a PNG file")
+
+    while True:
+        header = f.read(8)
+        if not header:
+            return
+        if len(header) < 8:
+            raise PNGError("Truncated chunk header")
+
+        length, chunk_type = struct.unpack(">I4s", header)
+        data = f.read(length)
+        crc = f.read(4)
+        if len(data) < length or len(crc) < 4:
+            raise PNGError(f"Truncated {chunk_type.decode('latin-1')} chunk")
+        if verify_crc and (
+            struct.unpack(">I", crc)[0]
+            != zlib.crc32(data, zlib.crc32(chunk_type)) & 0xFFFFFFFF
+        ):
+            raise PNGError(f"Corrupt {chunk_type.decode('latin-1')} chunk")
+        yield chunk_type, data
+
+        if chunk_type == b"IEND":
+            return
+
+
+def iter_chunk_headers(f, read_types=(b"IHDR", b"acTL", b"fcTL")):
+    """Yields the (type, length, data) of every chunk, seeking past the
+    payload of all chunks not in `read_types`, whose data is None.
+
+    Only the small control chunks are read, so even very large files are
+    scanned with a few reads per frame.
+
+    Raises:
+        PNGError: if the file isn't a PNG or a chunk is truncated.
+    """
+    if f.read(8) != PNG_SIGNATURE:
+        raise PNGError("Not a PNG file")
+
+    size = os.fstat(f.fileno()).st_size
+    while True:
+        header = f.read(8)
+        if not header:
+            return
+        if len(header) < 8:
+            raise PNGError("Truncated chunk header")
+
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type in read_types:
+            data = f.read(length)
+            if len(data) < length:
+                raise PNGError(
+                    f"Truncated {chunk_type.decode('latin-1')} chunk"
+                )
+            f.seek(4, os.SEEK_CUR)
+        else:
+            data = None
+            f.seek(length + 4, os.SEEK_CUR)
+        if f.tell() > size:
+            raise PNGError(f"Truncated {chunk_type.decode('latin-1')} chunk")
+        yield chunk_type, length, data
+
+        if chunk_type == b"IEND":
+            return
+
+
+def read_chunks(path):
+    """Returns the list of (type, data) chunks of a PNG file"""
+    with open(path, "rb") as f:
+        return list(iter_chunks(f))
+
+
+def write_chunk(f, chunk_type, data):
+    """Writes a chunk with its length and CRC"""
+    f.write(struct.pack(">I", len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+
+def write_chunks(path, chunks):
+    """Writes a PNG file from a list of (type, data) chunks"""
+    with open(path, "wb") as f:
+        f.write(PNG_SIGNATURE)
+        for chunk_type, data in chunks:
+            write_chunk(f, chunk_type, data)
+
+
+def parse_ihdr(data):
+    """Returns the fields of an IHDR chunk as a dictionary"""
+    (width, height, bit_depth, color_type, compression, filter_method,
+     interlace) = struct.unpack(">IIBBBBB", data[:13])
+    return {
+        "width": width,
+        "height": height,
+        "bit_depth": bit_depth,
+        "color_type": color_type,
+        "interlace": interlace,
+    }
+
+
+def parse_fctl(data):
+    """Returns the fields of an APNG fcTL (frame control) chunk"""
+    (sequence, width, height, x_offset, y_offset, delay_num, delay_den,
+     dispose_op, blend_op) = struct.unpack(">IIIIIHHBB", data[:26])
+    return {
+        "sequence": sequence,
+        "width": width,
+        "height": height,
+        "x_offset": x_offset,
+        "y_offset": y_offset,
+        "delay_num": delay_num,
+        # A denominator of 0 means 1/100th of a second
+        "delay_den": delay_den or 100,
+        "dispose_op": dispose_op,
+        "blend_op": blend_op,
+    }
+
+
+def parse_actl(data):
+    """Returns the fields of an APNG acTL (animation control) chunk"""
+    frames, plays = struct.unpack(">II", data[:8])
+    return {"frames": frames, "plays": plays}
+
+
+def get_bits_per_pixel(ihdr):
+    return CHANNELS[ihdr["color_type"]] * ihdr["bit_depth"]
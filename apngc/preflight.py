@@ -0,0 +1,198 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .apng import APNGProcessorHeadless, is_video
+from .png import PNGError, iter_chunks, parse_ihdr
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+PREFLIGHT_THREADS = 8
+RGBA = 6  # PNG color type
+
+
+def check_png(path):
+    """Reads a PNG chunk by chunk and verifies its structure and CRCs.
+
+    Returns:
+        ihdr (dict): the IHDR fields of the PNG.
+    Raises:
+        PNGError: if the file isn't a valid PNG.
+    """
+    ihdr = None
+    has_data = False
+    last = None
+    with open(path, "rb") as f:
+        for chunk_type, data in iter_chunks(f, verify_crc=True):
+            if last is None:
+                if chunk_type != b"IHDR":
+                    raise PNGError("First chunk is not IHDR")
+                ihdr = parse_ihdr(data)
+            has_data = has_data or chunk_type == b"IDAT"
+            last = chunk_type
+
+    if last is None:
+        raise PNGError("No chunks")
+    if not has_data:
+        raise PNGError("No image data")
+    if last != b"IEND":
+        raise PNGError("Missing IEND chunk")
+    return ihdr
+
+
+def _check_file(path):
+    """Returns the (ihdr, error) of a sequence file, ihdr is None for
+    formats other than PNG."""
+    try:
+        if path.lower().endswith(".png"):
+            return check_png(path), None
+        if not os.path.getsize(path):
+            return None, "Empty file"
+        return None, None
+    except (OSError, PNGError) as e:
+        return None, str(e)
+
+
+def format_ranges(numbers):
+    """Returns sorted numbers as compact ranges, like `3-5, 9`"""
+    ranges = []
+    for number in numbers:
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ", ".join(
+        str(start) if start == end else f"{start}-{end}"
+        for start, end in ranges
+    )
+
+
+def preflight(seq_dirs, settings, threads=PREFLIGHT_THREADS):
+    """Checks the sequences of a batch before anything is encoded.
+
+    Frame numbers are checked for gaps and every frame is checked in
+    parallel: PNGs are read chunk by chunk, verifying signature, structure
+    and CRCs, and their IHDRs must agree on size, bit depth and color
+    type.
+
+    Args:
+        seq_dirs (lst): the folders (or video files) to check.
+        settings (dict): the settings they will be converted with, for
+            the frame range.
+        threads (int): the number of files checked at the same time.
+    Returns:
+        reports (lst): a report per folder, in order, with `errors` that
+            reject the folder and `warnings` that don't.
+    """
+    reports = []
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        # Submit all files first, so every folder is checked in parallel
+        pending = []
+        for seq_dir in seq_dirs:
+            report = {
+                "folder": seq_dir,
+                "frames": 0,
+                "errors": [],
+                "warnings": [],
+            }
+            reports.append(report)
+            files = _check_frames(seq_dir, settings, report)
+            futures = [
+                executor.submit(_check_file, os.path.join(seq_dir, filename))
+                for filename in files
+            ]
+            pending.append((report, files, futures))
+
+        for report, files, futures in pending:
+            _check_headers(
+                report, files, [future.result() for future in futures]
+            )
+
+    for report in reports:
+        report["ok"] = not report["errors"]
+    return reports
+
+
+def _check_frames(seq_dir, settings, report):
+    """Checks the frame count and numbering, returns the frame files"""
+    if is_video(seq_dir):
+        if not os.path.isfile(seq_dir):
+            report["errors"].append("Video file not found")
+        return []
+
+    processor = APNGProcessorHeadless(seq_dir, settings)
+    try:
+        files = processor._get_image_files()
+    except OSError as e:
+        report["errors"].append(str(e))
+        return []
+
+    report["frames"] = len(files)
+    if len(files) < 2:
+        report["errors"].append(
+            f"Found {len(files)} frame(s), at least 2 are needed"
+        )
+
+    numbers = []
+    for filename in files:
+        try:
+            numbers.append(int(processor._get_start_frame(filename)))
+        except ValueError:
+            report["errors"].append(f"{filename}: No frame number")
+    if numbers:
+        missing = sorted(
+            set(range(min(numbers), max(numbers) + 1)) - set(numbers)
+        )
+        if missing:
+            report["errors"].append(
+                f"Missing frame(s) {format_ranges(missing)}"
+            )
+    return files
+
+
+def _check_headers(report, files, results):
+    """Adds the errors of single files and of mixed IHDRs to a report"""
+    first = None
+    for filename, (ihdr, error) in zip(files, results):
+        if error:
+            report["errors"].append(f"{filename}: {error}")
+            continue
+        if not ihdr:
+            continue
+        if not first:
+            first = (filename, ihdr)
+            continue
+
+        first_filename, first_ihdr = first
+        if (ihdr["width"], ihdr["height"]) != (
+            first_ihdr["width"], first_ihdr["height"]
+        ):
+            report["errors"].append(
+                f"{filename}: {ihdr['width']}x{ihdr['height']} differs from "
+                f"{first_ihdr['width']}x{first_ihdr['height']} of "
+                f"{first_filename}"
+            )
+        elif (ihdr["color_type"], ihdr["bit_depth"]) != (
+            first_ihdr["color_type"], first_ihdr["bit_depth"]
+        ):
+            report["errors"].append(
+                f"{filename}: Color type {ihdr['color_type']} at "
+                f"{ihdr['bit_depth']} bits differs from "
+                f"{first_ihdr['color_type']} at {first_ihdr['bit_depth']} "
+                f"bits of {first_filename}"
+            )
+
+    if first and first[1]["color_type"] != RGBA:
+        report["warnings"].append(
+            f"Frames are color type {first[1]['color_type']}, not RGBA"
+        )
+
+
+def format_preflight(report):
+    """Returns a short human readable summary of a preflight report"""
+    status = "OK" if report["ok"] else "REJECTED"
+    lines = [f"{status} {report['folder']} ({report['frames']} frames)"]
+    lines.extend(f"  error: {error}" for error in report["errors"])
+    lines.extend(f"  warning: {warning}" for warning in report["warnings"])
+    return "\n".join(lines)
@@ -0,0 +1,128 @@
+import logging
+import math
+import os
+import threading
+from contextlib import contextmanager
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+# Source pixels (width * height * frames) worth giving a thread of their own
+PIXELS_PER_THREAD = 100 * 1920 * 1080
+# Frames each ffmpeg thread keeps in flight, decoded and encoded
+BUFFERED_FRAMES = 4
+# Fixed cost of an ffmpeg process besides its frames
+PROCESS_MEMORY = 64 * 1024 ** 2
+# Part of the physical memory used when no memory budget is given
+MEMORY_FRACTION = 0.8
+
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(size):
+    """Returns the number of bytes of a size like `512M` or `16G`"""
+    if size is None:
+        return None
+    size = str(size).strip().upper().rstrip("B")
+    if size and size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+def get_total_memory():
+    """Returns the physical memory in bytes, or None if unknown"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        # Not available on Windows
+        return None
+
+
+def get_job_threads(source_size, frames, max_threads):
+    """Returns how many threads a job is worth, based on its pixel count.
+
+    Small sequences get a single thread so many can run side by side,
+    long high resolution sequences get up to `max_threads`.
+    """
+    work = source_size[0] * source_size[1] * max(frames, 1)
+    return max(1, min(max_threads, math.ceil(work / PIXELS_PER_THREAD)))
+
+
+def get_job_memory(source_size, size, threads):
+    """Returns the estimated peak memory in bytes of a job.
+
+    Every thread holds a few decoded source frames (at up to 16 bits per
+    channel) and resized frames in flight, besides a fixed process cost.
+    """
+    frame_bytes = source_size[0] * source_size[1] * 8 + size[0] * size[1] * 4
+    return threads * (PROCESS_MEMORY + frame_bytes * BUFFERED_FRAMES)
+
+
+class ResourceBudget:
+    """Ceilings of CPU threads and memory shared by the running jobs.
+
+    Jobs reserve threads and memory before processing and block until the
+    reservation fits in what the other running jobs left over. A job that
+    needs more than the whole budget is admitted alone.
+    """
+
+    def __init__(self, threads=None, memory=None):
+        self.threads = threads or os.cpu_count() or 1
+        if memory is None:
+            total = get_total_memory()
+            memory = int(total * MEMORY_FRACTION) if total else None
+        self.memory = memory
+
+        self._used_threads = 0
+        self._used_memory = 0
+        self._changed = threading.Condition()
+
+    def fit(self, source_size, size, frames):
+        """Returns the (threads, memory) reservation for a job.
+
+        The threads a job is worth are reduced until its memory fits in
+        the budget, so large frames get fewer threads instead of being
+        killed for running out of memory.
+        """
+        threads = get_job_threads(source_size, frames, self.threads)
+        memory = get_job_memory(source_size, size, threads)
+        while self.memory and memory > self.memory and threads > 1:
+            threads -= 1
+            memory = get_job_memory(source_size, size, threads)
+        return threads, memory
+
+    def acquire(self, threads, memory):
+        """Blocks until `threads` and `memory` are available and takes
+        them. Returns the reservation actually taken."""
+        threads = min(threads, self.threads)
+        if self.memory:
+            memory = min(memory, self.memory)
+        with self._changed:
+            self._changed.wait_for(lambda: self._fits(threads, memory))
+            self._used_threads += threads
+            self._used_memory += memory
+        LOGGER.debug(
+            f"Reserved {threads} thread(s) and {memory // 1024 ** 2} MB"
+        )
+        return threads, memory
+
+    def release(self, threads, memory):
+        with self._changed:
+            self._used_threads -= threads
+            self._used_memory -= memory
+            self._changed.notify_all()
+
+    @contextmanager
+    def reserve(self, threads, memory):
+        reservation = self.acquire(threads, memory)
+        try:
+            yield reservation
+        finally:
+            self.release(*reservation)
+
+    def _fits(self, threads, memory):
+        if self._used_threads + threads > self.threads:
+            return False
+        if self.memory and self._used_memory + memory > self.memory:
+            return False
+        return True
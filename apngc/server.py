@@ -0,0 +1,308 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .apng import APNGProcessorHeadless
+from .constants import SERVER_HOST, SERVER_PORT
+from .settings import PresetCache, validate_settings
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (DONE, FAILED)
+
+JOB_RETENTION = 24 * 60 * 60  # seconds finished jobs can still be queried
+MAX_FINISHED_JOBS = 1000  # finished jobs kept at most
+
+
+class Job:
+    """A single queued conversion and its current status"""
+
+    def __init__(self, folder, settings, priority=0):
+        self.id = uuid.uuid4().hex[:12]
+        self.folder = folder
+        self.settings = settings
+        self.priority = priority
+        self.status = QUEUED
+        self.progress = 0
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+        self._changed = threading.Condition()
+
+    def update(self, **kwargs):
+        with self._changed:
+            for key, value in kwargs.items():
+                setattr(self, key, value)
+            self._changed.notify_all()
+
+    def wait_for_change(self, last_state, timeout=None):
+        """Blocks until the job state differs from `last_state`"""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self.to_dict() != last_state, timeout=timeout
+            )
+            return self.to_dict()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "folder": self.folder,
+            "priority": self.priority,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """Priority queue of jobs processed by a pool of warm worker threads.
+
+    Higher priorities are processed first, equal priorities in
+    submission order. Finished jobs are forgotten after `JOB_RETENTION`
+    seconds, or sooner when more than `MAX_FINISHED_JOBS` have finished.
+    """
+
+    def __init__(self, workers=None, budget=None):
+        self.jobs = {}
+        self._jobs_lock = threading.Lock()
+        self.budget = budget
+        self.presets = PresetCache()
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._threads = []
+        self.workers = workers or os.cpu_count() or 1
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"apngc-worker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, folder, preset, output_path=None, tinify=None,
+               priority=0):
+        """Queues a folder for conversion with the given preset.
+
+        Raises:
+            FileNotFoundError: if the preset cannot be found.
+            ValueError: if the resulting settings are invalid.
+        """
+        settings = self.presets.get(preset)
+        if tinify:
+            settings["tinify_key"] = tinify
+        if output_path:
+            settings["output_path"] = output_path
+
+        errors = validate_settings(settings)
+        if errors:
+            raise ValueError(" ".join(errors))
+
+        job = Job(os.path.abspath(folder), settings, priority)
+        with self._jobs_lock:
+            self.jobs[job.id] = job
+        self._queue.put((-priority, next(self._counter), job))
+        LOGGER.info(f"Queued job {job.id}: {job.folder}")
+        return job
+
+    def get_job(self, job_id):
+        with self._jobs_lock:
+            return self.jobs.get(job_id)
+
+    def get_jobs(self):
+        with self._jobs_lock:
+            return list(self.jobs.values())
+
+    def _prune(self):
+        """Forgets the oldest finished jobs past the retention limits"""
+        with self._jobs_lock:
+            finished = sorted(
+                (job for job in self.jobs.values() if job.finished),
+                key=lambda job: job.finished,
+            )
+            expired = time.time() - JOB_RETENTION
+            excess = len(finished) - MAX_FINISHED_JOBS
+            for index, job in enumerate(finished):
+                if index >= excess and job.finished >= expired:
+                    break
+                del self.jobs[job.id]
+
+    def _work(self):
+        while True:
+            _priority, _index, job = self._queue.get()
+            job.update(status=RUNNING)
+            processor = APNGProcessorHeadless(
+                job.folder, job.settings, budget=self.budget
+            )
+            try:
+                for progress in processor.iter_process():
+                    job.update(progress=job.progress + progress)
+            except Exception as e:
+                LOGGER.error(f"Job {job.id} failed: {e}")
+                job.update(status=FAILED, error=str(e), finished=time.time())
+            else:
+                job.update(status=DONE, finished=time.time())
+            finally:
+                self._queue.task_done()
+            self._prune()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """HTTP API for the job queue.
+
+    POST /jobs               submit a job, returns its status
+    GET  /jobs               status of all jobs
+    GET  /jobs/<id>          status of a single job
+    GET  /jobs/<id>/events   streams status lines until the job finishes
+    """
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format % args)
+
+    @property
+    def job_queue(self):
+        return self.server.job_queue
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            jobs = [job.to_dict() for job in self.job_queue.get_jobs()]
+            return self._send_json(200, jobs)
+
+        if len(parts) not in (2, 3) or parts[0] != "jobs":
+            return self._send_json(404, {"error": "Not found"})
+
+        job = self.job_queue.get_job(parts[1])
+        if not job:
+            return self._send_json(404, {"error": f"No job: {parts[1]}"})
+
+        if len(parts) == 2:
+            return self._send_json(200, job.to_dict())
+        if parts[2] == "events":
+            return self._stream_events(job)
+        return self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path.strip("/") != "jobs":
+            return self._send_json(404, {"error": "Not found"})
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            data = json.loads(self.rfile.read(length) or b"{}")
+            job = self.job_queue.submit(
+                data["folder"],
+                data["settings"],
+                output_path=data.get("output_path"),
+                tinify=data.get("tinify"),
+                priority=int(data.get("priority", 0)),
+            )
+        except KeyError as e:
+            return self._send_json(400, {"error": f"Missing field: {e}"})
+        except (ValueError, FileNotFoundError) as e:
+            return self._send_json(400, {"error": str(e)})
+
+        self._send_json(202, job.to_dict())
+
+    def _send_json(self, code, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_events(self, job):
+        # One JSON document per line, connection closes when job finishes
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        state = None
+        while True:
+            state = job.wait_for_change(state, timeout=30)
+            try:
+                self.wfile.write((json.dumps(state) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            if state["status"] in FINISHED_STATES:
+                return
+
+
+def serve(host=SERVER_HOST, port=SERVER_PORT, workers=None, budget=None):
+    """Runs the conversion server until interrupted"""
+    job_queue = JobQueue(workers, budget)
+    job_queue.start()
+
+    server = ThreadingHTTPServer((host, port), JobRequestHandler)
+    server.daemon_threads = True
+    server.job_queue = job_queue
+    LOGGER.info(
+        f"Serving on http://{host}:{port} with {job_queue.workers} workers"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def submit_job(folder, preset, output_path=None, tinify=None, priority=0,
+               host=SERVER_HOST, port=SERVER_PORT):
+    """Submits a job to a running server and returns its status"""
+    # Send absolute paths, the server may run from another directory
+    if os.path.isfile(preset):
+        preset = os.path.abspath(preset)
+    if output_path:
+        output_path = os.path.abspath(output_path)
+
+    data = {
+        "folder": os.path.abspath(folder),
+        "settings": preset,
+        "output_path": output_path,
+        "tinify": tinify,
+        "priority": priority,
+    }
+    request = urllib.request.Request(
+        f"http://{host}:{port}/jobs",
+        data=json.dumps(data).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.load(e).get("error", str(e)))
+
+
+def iter_job_events(job_id, host=SERVER_HOST, port=SERVER_PORT):
+    """Yields status updates of a job until it has finished"""
+    url = f"http://{host}:{port}/jobs/{job_id}/events"
+    while True:
+        try:
+            response = urllib.request.urlopen(url)
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(json.load(e).get("error", str(e)))
+        with response:
+            for line in response:
+                state = json.loads(line)
+                yield state
+                if state["status"] in FINISHED_STATES:
+                    return
@@ -2,10 +2,11 @@ import json
 import logging
 import os
 import shutil
+import threading
 
 import tinify
 
-from .constants import PACKAGE
+from .constants import OUTPUT_FORMATS, PACKAGE
 
 # LOGGING
 LOGGER = logging.getLogger(__name__)
@@ -102,4 +103,43 @@ def validate_settings(settings):
                 f"Output path does not exist: '{settings.get('output_path')}'."
             )
 
+    for output_format in settings.get("formats") or []:
+        if output_format not in OUTPUT_FORMATS:
+            errors.append(
+                f"Unknown output format '{output_format}', "
+                f"use one of {', '.join(OUTPUT_FORMATS)}."
+            )
+
     return errors
+
+
+class PresetCache:
+    """Keeps loaded settings presets in memory between jobs.
+
+    A preset is reloaded only when its file changes on disk.
+    """
+
+    def __init__(self):
+        self._presets = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, preset):
+        """Returns the settings file for a preset name or path"""
+        if os.path.isfile(preset):
+            return os.path.abspath(preset)
+        return os.path.join(get_local_settings_path(), preset + ".json")
+
+    def get(self, preset):
+        """Returns a copy of the settings for a preset name or path"""
+        settings_file = self.resolve(preset)
+        if not os.path.isfile(settings_file):
+            raise FileNotFoundError(f"Settings not found: {preset}")
+
+        mtime = os.path.getmtime(settings_file)
+        with self._lock:
+            cached = self._presets.get(settings_file)
+            if not cached or cached[0] != mtime:
+                LOGGER.debug(f"Loading settings: {settings_file}")
+                cached = (mtime, get_settings(settings_file))
+                self._presets[settings_file] = cached
+        return dict(cached[1])
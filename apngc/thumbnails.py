@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+from .apng import (
+    APNGProcessorHeadless,
+    get_ffmpeg_exe,
+    get_video_info,
+    is_video,
+)
+from .journal import inputs_hash
+from .settings import get_local_settings_path
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+THUMBNAIL_HEIGHT = 30
+THUMBNAIL_FRAMES = 12
+CACHE_SIZE = 64 * 1024 ** 2  # bytes kept on disk before evicting
+
+
+def get_thumbnail_cache_path():
+    """Returns the directory thumbnails are cached in"""
+    return os.path.join(
+        os.path.dirname(get_local_settings_path()), "thumbnails"
+    )
+
+
+def get_thumbnail_key(seq_dir):
+    """Returns the cache key of a folder's thumbnail.
+
+    Based on the names, sizes and modification times of its files, so
+    re-dropping an unchanged folder hits the cache and re-rendered frames
+    don't.
+    """
+    data = f"{inputs_hash(seq_dir)}:{THUMBNAIL_HEIGHT}:{THUMBNAIL_FRAMES}"
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def get_thumbnail_frames(seq_dir, cache_dir=None):
+    """Returns the frames of a folder's animated thumbnail.
+
+    Thumbnails are generated on first request and then kept in the cache,
+    the cache entry is marked as used on every request.
+
+    Args:
+        seq_dir (str): the folder (or video file) to preview.
+        cache_dir (str): the cache directory, defaults to
+            `get_thumbnail_cache_path`.
+    Returns:
+        frames (lst): the paths of the thumbnail frames, in order. Empty
+            if no preview could be made.
+    """
+    cache_dir = cache_dir or get_thumbnail_cache_path()
+    entry = os.path.join(cache_dir, get_thumbnail_key(seq_dir))
+    if not os.path.isdir(entry):
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=cache_dir, prefix=".")
+        try:
+            _render_thumbnail(seq_dir, temp_dir)
+            if os.listdir(temp_dir):
+                os.rename(temp_dir, entry)
+        except OSError:
+            # Another thread rendered the same entry first
+            pass
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        evict(cache_dir)
+
+    if not os.path.isdir(entry):
+        return []
+    # Mark as recently used for the LRU eviction
+    os.utime(entry)
+    return [
+        os.path.join(entry, filename)
+        for filename in sorted(os.listdir(entry))
+    ]
+
+
+def _render_thumbnail(seq_dir, out_dir):
+    """Renders up to THUMBNAIL_FRAMES evenly spread, downsampled frames"""
+    if is_video(seq_dir):
+        info = get_video_info(seq_dir)
+        frames = info["frames"] if info else THUMBNAIL_FRAMES
+        input_args = ["-i", seq_dir]
+    else:
+        processor = APNGProcessorHeadless(seq_dir, {})
+        files = processor._get_image_files()
+        if not files:
+            return
+        start_frame = processor._get_start_frame(files[0])
+        processor.files = files
+        seq = os.path.join(seq_dir, processor._get_basename(start_frame))
+        frames = len(files)
+        input_args = ["-start_number", str(int(start_frame)), "-i", seq,
+                      "-frames:v", str(frames)]
+
+    step = max(1, frames // THUMBNAIL_FRAMES)
+    ffmpeg_cmd = [
+        get_ffmpeg_exe(), "-v", "error", "-y", *input_args,
+        "-vf", f"select=not(mod(n\\,{step})),scale=-2:{THUMBNAIL_HEIGHT}",
+        "-fps_mode", "vfr", "-frames:v", str(THUMBNAIL_FRAMES),
+        "-pix_fmt", "rgba", os.path.join(out_dir, "%03d.png"),
+    ]
+    LOGGER.debug(
+        f"FFMPEG Thumbnail Command: {subprocess.list2cmdline(ffmpeg_cmd)}"
+    )
+    subprocess.call(ffmpeg_cmd)
+
+
+def evict(cache_dir, max_size=CACHE_SIZE):
+    """Removes the least recently used thumbnails over `max_size` bytes"""
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if name.startswith(".") or not os.path.isdir(entry):
+            continue
+        size = sum(
+            os.path.getsize(os.path.join(entry, filename))
+            for filename in os.listdir(entry)
+        )
+        entries.append((os.path.getmtime(entry), size, entry))
+        total += size
+
+    for _used, size, entry in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
@@ -0,0 +1,84 @@
+import logging
+
+import numpy as np
+
+from .frames import iter_raw_frames
+
+# LOGGING
+LOGGER = logging.getLogger(__name__)
+
+
+def get_alpha_bbox(input_args, width, height, filters=None, threshold=0):
+    """Returns the union bounding box of visible pixels of all frames.
+
+    Only the alpha channel is piped from ffmpeg and every frame is reduced
+    to its row and column coverage, so the pass is cheap compared to the
+    resize itself.
+
+    Args:
+        input_args (lst): the ffmpeg input arguments of the sequence.
+        width (int): the width of the frames.
+        height (int): the height of the frames.
+        filters (lst): optional ffmpeg filters to apply before reading.
+        threshold (int): alpha values up to this count as transparent.
+    Returns:
+        bbox (tuple): (x, y, width, height) of the visible area, or None if
+            every frame is fully transparent.
+    """
+    filters = list(filters or []) + ["format=rgba", "alphaextract"]
+    rows = np.zeros(height, dtype=bool)
+    columns = np.zeros(width, dtype=bool)
+    for alpha in iter_raw_frames(
+        input_args, width, height, filters=filters, pix_fmt="gray"
+    ):
+        visible = alpha[:, :, 0] > threshold
+        rows |= visible.any(axis=1)
+        columns |= visible.any(axis=0)
+
+    if not rows.any():
+        return None
+
+    y0, y1 = np.flatnonzero(rows)[[0, -1]]
+    x0, x1 = np.flatnonzero(columns)[[0, -1]]
+    return int(x0), int(y0), int(x1 - x0 + 1), int(y1 - y0 + 1)
+
+
+def get_trim_filters(bbox, source_size, width, height, pad=False):
+    """Returns ffmpeg filters that crop to `bbox` and then resize.
+
+    The crop is scaled by the same factors as the full frame would be, so
+    the content keeps its size. With `pad` the result is padded with
+    transparent pixels back to `width` x `height`, at its original
+    position.
+
+    Args:
+        bbox (tuple): (x, y, width, height) to crop to, in source pixels.
+        source_size (tuple): (width, height) of the source frames.
+        width (int): the width the full frame would be resized to
+        height (int): the height the full frame would be resized to
+        pad (bool): whether to pad back to the full resolution.
+    Returns:
+        filters (lst): the ffmpeg filters.
+    """
+    x, y, crop_width, crop_height = bbox
+    scale_x = width / source_size[0]
+    scale_y = height / source_size[1]
+    out_width = min(width, max(1, round(crop_width * scale_x)))
+    out_height = min(height, max(1, round(crop_height * scale_y)))
+    LOGGER.info(
+        f"Trimming to {crop_width}x{crop_height} at {x},{y}, "
+        f"resized to {out_width}x{out_height}"
+    )
+
+    filters = [
+        f"crop={crop_width}:{crop_height}:{x}:{y}",
+        f"scale={out_width}:{out_height}:flags=lanczos",
+    ]
+    if pad:
+        offset_x = min(round(x * scale_x), width - out_width)
+        offset_y = min(round(y * scale_y), height - out_height)
+        filters += [
+            "format=rgba",
+            f"pad={width}:{height}:{offset_x}:{offset_y}:color=0x00000000",
+        ]
+    return filters
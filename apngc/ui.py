@@ -2,8 +2,16 @@ import logging
 import os
 import sys
 import threading
-
-from PySide6.QtCore import QFile, QObject, QRegularExpression, Qt, Signal
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide6.QtCore import (
+    QFile,
+    QObject,
+    QRegularExpression,
+    Qt,
+    QTimer,
+    Signal,
+)
 from PySide6.QtGui import (
     QIcon,
     QPainter,
@@ -26,8 +34,10 @@ from PySide6.QtWidgets import (
     QStyleFactory
 )
 
-from .apng import APNGProcessor, get_directories_with_files
+from .apng import APNGProcessor, get_directories_with_files, is_video
 from .constants import PACKAGE
+from .journal import Journal, get_journal_path
+from .resources import ResourceBudget
 from .settings import (
     discover_settings,
     get_settings,
@@ -39,10 +49,14 @@ from .settings import (
 # LOGGING
 LOGGER = logging.getLogger(__name__)
 
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_INTERVAL = 125  # ms per preview frame
+
 
 class DropWidget(QWidget):
     directory_deleted = Signal(bool)
     stage_empty = Signal(bool)
+    thumbnail_loaded = Signal(str, list)
 
     def __init__(self):
         super().__init__()
@@ -51,6 +65,15 @@ class DropWidget(QWidget):
 
         self.directories = []
 
+        # PREVIEWS ARE RENDERED IN THE BACKGROUND, ONLY FOR VISIBLE ROWS
+        self.thumbnail_pool = ThreadPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS
+        )
+        self.thumbnail_loaded.connect(self.set_thumbnail)
+        self.thumbnail_timer = QTimer(self)
+        self.thumbnail_timer.timeout.connect(self.advance_thumbnails)
+        self.thumbnail_timer.start(THUMBNAIL_INTERVAL)
+
         self.layout = QVBoxLayout()
         self.label = None
         self.setLayout(self.layout)
@@ -80,7 +103,10 @@ class DropWidget(QWidget):
         if urls:
             for url in urls:
                 folder_path = url.toLocalFile()
-                subfolders = get_directories_with_files(folder_path)
+                if is_video(folder_path):
+                    subfolders = [folder_path]
+                else:
+                    subfolders = get_directories_with_files(folder_path)
                 for subfolder in subfolders:
                     dir_wig = self.create_dir_wig(subfolder)
                     self.layout.addWidget(dir_wig)
@@ -92,6 +118,9 @@ class DropWidget(QWidget):
                         self.layout.setAlignment(Qt.AlignTop)
 
                         self.stage_empty.emit(False)
+
+            # WAIT FOR THE LAYOUT TO PLACE THE NEW ROWS
+            QTimer.singleShot(0, self.load_visible_thumbnails)
         else:
             event.ignore()
 
@@ -99,6 +128,10 @@ class DropWidget(QWidget):
         wig = load_ui("directory")
         wig.folder_LED.setText(path)
         wig.del_BTN.clicked.connect(lambda: self.delete_dir_wig(wig))
+        wig.thumbnail_path = path
+        wig.thumbnail_requested = False
+        wig.thumbnail_frames = []
+        wig.thumbnail_index = 0
         self.directories.append(wig)
 
         set_icon(wig.del_BTN, "close")
@@ -122,6 +155,52 @@ class DropWidget(QWidget):
         if num_dirs > 0:
             self.create_label()
 
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.load_visible_thumbnails()
+
+    def load_visible_thumbnails(self):
+        """Starts rendering the previews of rows scrolled into view"""
+        for wig in self.directories:
+            if wig.thumbnail_requested or wig.visibleRegion().isEmpty():
+                continue
+            wig.thumbnail_requested = True
+            self.thumbnail_pool.submit(
+                self.render_thumbnail, wig.thumbnail_path
+            )
+
+    def render_thumbnail(self, path):
+        # RUNS IN THE THUMBNAIL POOL, THE SIGNAL IS QUEUED TO THE UI THREAD
+        from .thumbnails import get_thumbnail_frames
+
+        try:
+            frames = get_thumbnail_frames(path)
+        except Exception as e:
+            LOGGER.warning(f"Could not render preview of {path}: {e}")
+            frames = []
+        self.thumbnail_loaded.emit(path, frames)
+
+    def set_thumbnail(self, path, frames):
+        pixmaps = [QPixmap(frame) for frame in frames]
+        pixmaps = [pixmap for pixmap in pixmaps if not pixmap.isNull()]
+        for wig in self.directories:
+            if wig.thumbnail_path == path:
+                wig.thumbnail_frames = pixmaps
+                wig.thumbnail_index = 0
+                if pixmaps:
+                    wig.preview_LBL.setPixmap(pixmaps[0])
+
+    def advance_thumbnails(self):
+        for wig in self.directories:
+            if len(wig.thumbnail_frames) < 2 or wig.visibleRegion().isEmpty():
+                continue
+            wig.thumbnail_index = (
+                (wig.thumbnail_index + 1) % len(wig.thumbnail_frames)
+            )
+            wig.preview_LBL.setPixmap(
+                wig.thumbnail_frames[wig.thumbnail_index]
+            )
+
 
 class ApngConverter(QMainWindow):
     failed_directory = Signal(QWidget)
@@ -133,7 +212,10 @@ class ApngConverter(QMainWindow):
         self.setGeometry(100, 100, 800, 600)
 
         self.settings_data = {}
+        self.settings = {}
         self.total_progress = 0
+        self.journal = None
+        self.budget = ResourceBudget()
 
         # LOAD UI
         self.ui = load_ui("main")
@@ -141,6 +223,9 @@ class ApngConverter(QMainWindow):
 
         self.drop_widget = DropWidget()
         self.ui.dd_SCR.setWidget(self.drop_widget)
+        self.ui.dd_SCR.verticalScrollBar().valueChanged.connect(
+            self.drop_widget.load_visible_thumbnails
+        )
 
         # STORE CTL THAT WILL TOGGLE ENABLE\DISABLE STATES WHEN PROCESSING
         self.toggle_ctls = [
@@ -240,7 +325,9 @@ class ApngConverter(QMainWindow):
             ctl.setEnabled(enable)
 
     def get_current_settings(self):
-        return {
+        # Keep preset fields that have no control in the UI
+        settings = dict(self.settings)
+        settings.update({
             "width": self.ui.width_SPB.value(),
             "height": self.ui.height_SPB.value(),
             "framerate": self.ui.framerate_SPB.value(),
@@ -249,7 +336,8 @@ class ApngConverter(QMainWindow):
             "loops": self.ui.loops_SPB.value(),
             "hold": self.ui.hold_SPB.value(),
             "output_path": self.ui.output_LED.text(),
-        }
+        })
+        return settings
 
     def convert(self):
         # RESET PROGRESS
@@ -268,6 +356,9 @@ class ApngConverter(QMainWindow):
             self.show_error_dialog(errors)
             return
 
+        # RECORD PROGRESS IN THE OUTPUT DIRECTORY
+        self.journal = Journal(get_journal_path(self.settings["output_path"]))
+
         # DISABLE UI
         self.enable_ui(False)
 
@@ -307,6 +398,8 @@ class ApngConverter(QMainWindow):
         processor = APNGProcessor(
             seq_dir=directory_wig.folder_LED.text(),
             settings=self.settings,
+            journal=self.journal,
+            budget=self.budget,
         )
         processor.progress_changed.connect(
             lambda progress: self.update_progress(progress)
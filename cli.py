@@ -1,5 +1,6 @@
 # INITIALIZE LOGGER
 import logging
+import multiprocessing
 
 import apngc.__main__
 
@@ -13,4 +14,6 @@ logging.basicConfig(
 logging.info("Starting APNGC...")
 
 if __name__ == "__main__":
+    # Needed for process pools in the frozen executable
+    multiprocessing.freeze_support()
     apngc.__main__.main()